@@ -0,0 +1,140 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import asyncio
+import itertools
+import os
+import time
+from typing import Dict, Iterable, Optional
+import websockets
+from metrics import LatencyHistogram
+
+# Seconds to wait for clients to confirm a command
+ACK_TIMEOUT = float(os.environ.get("ACK_TIMEOUT", "5"))
+
+
+class TrackedCommand:
+    """A broadcast command waiting for its recipients to confirm it."""
+
+    def __init__(self, command_id: int, name: str, recipients: Iterable[websockets.ServerProtocol], due_at: float):
+        self.id = command_id
+        self.name = name
+        # Latency is measured from the moment the command is due: the send time, or the scheduled instant
+        self.due_at = due_at
+        self.expected = set(recipients)
+        self.latencies: Dict[websockets.ServerProtocol, float] = {}
+        self.superseded = 0
+        self.failed = 0
+        self.done = asyncio.Event()
+        if not self.expected:
+            self.done.set()
+
+    def tag(self, message: str) -> str:
+        """Append the command ID that clients echo back in their confirmation."""
+        return f"{message} #{self.id}"
+
+    def confirm(self, websocket: websockets.ServerProtocol, latency: float):
+        self.latencies[websocket] = latency
+        self._check_done()
+
+    def discard(self, websocket: websockets.ServerProtocol):
+        """Stop waiting for a client that will never confirm, e.g. because delivery failed."""
+        self.expected.discard(websocket)
+        self._check_done()
+
+    def supersede(self, websocket: websockets.ServerProtocol):
+        """Stop waiting for a client that dropped this command in favour of a newer one."""
+        if websocket in self.expected and websocket not in self.latencies:
+            self.superseded += 1
+            self.discard(websocket)
+
+    def fail(self, websocket: websockets.ServerProtocol):
+        """Stop waiting for a client that could not carry the command out, e.g. because VLC is down."""
+        if websocket in self.expected and websocket not in self.latencies:
+            self.failed += 1
+            self.discard(websocket)
+
+    def _check_done(self):
+        if len(self.latencies) >= len(self.expected):
+            self.done.set()
+
+    def summary(self) -> str:
+        confirmed = len(self.latencies)
+        total = len(self.expected)
+        text = f"{self.name} #{self.id}: confirmed by {confirmed} of {total} clients"
+        if confirmed:
+            text += f", slowest after {max(self.latencies.values()) * 1000:.0f}ms"
+        if self.superseded:
+            text += f", superseded on {self.superseded}"
+        if self.failed:
+            text += f", failed on {self.failed}"
+        return text
+
+
+class CommandTracker:
+    """Assigns command IDs, matches client confirmations to them and keeps latency histograms."""
+
+    def __init__(self, timeout: float = ACK_TIMEOUT):
+        self.timeout = timeout
+        self.pending: Dict[int, TrackedCommand] = {}
+        self.latency = LatencyHistogram()
+        self.host_latency: Dict[str, LatencyHistogram] = {}
+        self._ids = itertools.count(1)
+
+    def start(self, name: str, recipients: Iterable[websockets.ServerProtocol],
+              due_at: Optional[float] = None, command_id: Optional[int] = None) -> TrackedCommand:
+        """Track a new command; command_id is given when the cluster leader already numbered it."""
+        command = TrackedCommand(command_id or next(self._ids), name, recipients, due_at or time.monotonic())
+        self.pending[command.id] = command
+        return command
+
+    def ack(self, command_id: int, websocket: websockets.ServerProtocol, host: str) -> Optional[float]:
+        """Record a confirmation; returns its latency, or None if the command is unknown or already settled."""
+        command = self.pending.get(command_id)
+        if command is None or websocket not in command.expected or websocket in command.latencies:
+            return None
+        latency = max(0.0, time.monotonic() - command.due_at)
+        command.confirm(websocket, latency)
+        self.latency.observe(latency)
+        self.host_latency.setdefault(host, LatencyHistogram()).observe(latency)
+        return latency
+
+    def host_summary(self, host: str) -> Optional[dict]:
+        """Confirmation latency of a host's clients, None before its first confirmation."""
+        histogram = self.host_latency.get(host)
+        if histogram is None:
+            return None
+        return {"p50": histogram.percentile(0.5), "p95": histogram.percentile(0.95), "count": histogram.count}
+
+    def forget_host(self, host: str):
+        """Drop the latency of a host that has no clients left, so hosts that come and go do not pile up."""
+        self.host_latency.pop(host, None)
+
+    def supersede(self, command_id: int, websocket: websockets.ServerProtocol):
+        """Record that a client skipped a command because a newer one of the same kind arrived."""
+        command = self.pending.get(command_id)
+        if command is not None:
+            command.supersede(websocket)
+
+    def fail(self, command_id: int, websocket: websockets.ServerProtocol):
+        """Record that a client could not carry a command out."""
+        command = self.pending.get(command_id)
+        if command is not None:
+            command.fail(websocket)
+
+    async def wait(self, command: TrackedCommand) -> TrackedCommand:
+        """Wait until every recipient confirmed or the timeout passed, then stop tracking the command."""
+        try:
+            await asyncio.wait_for(command.done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.pending.pop(command.id, None)
+        return command
+
+
+def parse_ack(message: str) -> Optional[int]:
+    """Return the command ID a client message confirms (format: '<reply> #<id>'), if any."""
+    _, sep, command_id = message.rpartition(" #")
+    if sep and command_id.isdigit():
+        return int(command_id)
+    return None
@@ -0,0 +1,192 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""JSON admin API on the HTTP server, for dashboards and scripts that outgrow the Telegram bot.
+
+GET  /api/status    cluster-wide client counts, playback states and replicas
+GET  /api/clients   the clients of every replica, filtered by group, type, host, status or replica and paginated
+POST /api/commands  dispatch {"command": "seek", "timecode": "50%"} or {"command": "switch"} across the cluster,
+                    to one group with "group": "<name>"
+POST /api/profile   switch this replica's sampling profiler on or off with {"enabled": true|false}
+GET  /api/profile   the samples collected so far, as folded stacks
+
+Requests must carry "Authorization: Bearer <ADMIN_TOKEN>".
+"""
+import asyncio
+import hmac
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Set
+from aiohttp import web
+from cluster import ClusterCommand
+from log import log_event
+from loopwatch import LoopWatchdog
+from registry import is_valid_group
+import timecodes
+
+logger = logging.getLogger("muppet.admin")
+
+# Admin API configuration from environment variables with fallbacks
+# Bearer token for the admin API, empty disables it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Seconds a client snapshot is reused, so dashboards polling every second cost one walk over the clients
+ADMIN_SNAPSHOT_TTL = float(os.environ.get("ADMIN_SNAPSHOT_TTL", "1"))
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+COMMANDS = ("seek", "switch")
+
+
+def error(status: int, message: str) -> web.Response:
+    return web.json_response({"error": message}, status=status)
+
+
+class AdminAPI:
+    """Handlers of the admin API.
+
+    snapshot() lists the clients as JSON-ready dicts sorted the way pages are served, status()
+    describes the cluster, dispatch(command, timecode, group) publishes a command (raising ConnectionError
+    if it cannot) and wait(command) waits for its confirmation reports. The profile endpoints drive the
+    watchdog's profiler.
+    """
+
+    def __init__(self, snapshot: Callable[[], Awaitable[List[dict]]], status: Callable[[], Awaitable[dict]],
+                 dispatch: Callable[[str, Optional[str], Optional[str]], Awaitable[ClusterCommand]],
+                 wait: Callable[[ClusterCommand], Awaitable[ClusterCommand]],
+                 watchdog: Optional[LoopWatchdog] = None, token: str = ADMIN_TOKEN,
+                 snapshot_ttl: float = ADMIN_SNAPSHOT_TTL):
+        self.snapshot = snapshot
+        self.status = status
+        self.dispatch = dispatch
+        self.wait = wait
+        self.watchdog = watchdog
+        self.token = token
+        self.snapshot_ttl = snapshot_ttl
+        self._snapshot: List[dict] = []
+        self._snapshot_at: Optional[float] = None
+        # Waits for the confirmations of commands answered right away, which also stops tracking them
+        self._waiting: Set[asyncio.Task] = set()
+
+    def add_routes(self, app: web.Application):
+        app.router.add_get('/api/status', self.get_status)
+        app.router.add_get('/api/clients', self.get_clients)
+        app.router.add_post('/api/commands', self.post_command)
+        if self.watchdog is not None:
+            app.router.add_get('/api/profile', self.get_profile)
+            app.router.add_post('/api/profile', self.post_profile)
+
+    def _check(self, request: web.Request) -> Optional[web.Response]:
+        """Return an error response unless the request carries the admin token."""
+        if not self.token:
+            return error(403, "Admin API disabled, set ADMIN_TOKEN to enable it")
+        header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(header.encode(), f"Bearer {self.token}".encode()):
+            log_event(logger, "admin_unauthorized", "Rejected admin request from %s", request.remote,
+                      level=logging.WARNING, sampled=True, remote=request.remote)
+            return error(401, "Unauthorized")
+        return None
+
+    async def clients(self) -> List[dict]:
+        """The latest client snapshot, rebuilt at most once per snapshot_ttl."""
+        now = time.monotonic()
+        if self._snapshot_at is None or now - self._snapshot_at >= self.snapshot_ttl:
+            self._snapshot = await self.snapshot()
+            self._snapshot_at = now
+        return self._snapshot
+
+    async def get_status(self, request: web.Request) -> web.Response:
+        denied = self._check(request)
+        if denied is not None:
+            return denied
+        return web.json_response(await self.status())
+
+    async def get_clients(self, request: web.Request) -> web.Response:
+        """List clients (query: group, type, host, status, replica, offset, limit); host matches a substring."""
+        denied = self._check(request)
+        if denied is not None:
+            return denied
+        try:
+            offset = max(0, int(request.query.get("offset", "0")))
+            limit = min(MAX_PAGE_SIZE, max(1, int(request.query.get("limit", str(DEFAULT_PAGE_SIZE)))))
+        except ValueError:
+            return error(400, "offset and limit must be integers")
+
+        group = request.query.get("group")
+        client_type = request.query.get("type")
+        host = request.query.get("host")
+        status = request.query.get("status")
+        replica = request.query.get("replica")
+        matches = await self.clients()
+        if group or client_type or host or status or replica:
+            matches = [
+                client for client in matches
+                if (not group or client["group"] == group)
+                and (not client_type or client["type"] == client_type)
+                and (not host or host in client["host"])
+                and (not status or (client["playback"] or {}).get("status") == status)
+                and (not replica or client["replica"] == replica)
+            ]
+        return web.json_response({
+            "total": len(matches),
+            "offset": offset,
+            "limit": limit,
+            "clients": matches[offset:offset + limit],
+        })
+
+    async def post_command(self, request: web.Request) -> web.Response:
+        """Dispatch a command; with "wait": true, answer once its confirmations are in."""
+        denied = self._check(request)
+        if denied is not None:
+            return denied
+        try:
+            body = await request.json()
+        except ValueError:
+            return error(400, "Body must be a JSON object")
+        if not isinstance(body, dict) or body.get("command") not in COMMANDS:
+            return error(400, f"command must be one of {', '.join(COMMANDS)}")
+
+        timecode = None
+        if body["command"] == "seek":
+            timecode = str(body.get("timecode", "0"))
+            if not timecodes.is_valid(timecode):
+                return error(400, f"Invalid timecode: {timecode}")
+
+        group = body.get("group")
+        if group is not None and not (isinstance(group, str) and is_valid_group(group)):
+            return error(400, f"Invalid group: {group}")
+
+        try:
+            command = await self.dispatch(body["command"], timecode, group)
+        except ConnectionError as e:
+            return error(503, f"Could not dispatch the command: {e}")
+        log_event(logger, "admin_command", "Admin API dispatched %s #%d", body["command"], command.id,
+                  command=body["command"], command_id=command.id, group=group, remote=request.remote)
+        if not body.get("wait"):
+            task = asyncio.create_task(self.wait(command))
+            self._waiting.add(task)
+            task.add_done_callback(self._waiting.discard)
+            return web.json_response(command.as_dict(), status=202)
+        await self.wait(command)
+        return web.json_response(command.as_dict())
+
+    async def get_profile(self, request: web.Request) -> web.Response:
+        denied = self._check(request)
+        if denied is not None:
+            return denied
+        return web.Response(text=self.watchdog.dump(), content_type="text/plain")
+
+    async def post_profile(self, request: web.Request) -> web.Response:
+        denied = self._check(request)
+        if denied is not None:
+            return denied
+        try:
+            body = await request.json()
+        except ValueError:
+            return error(400, "Body must be a JSON object")
+        if not isinstance(body, dict) or not isinstance(body.get("enabled"), bool):
+            return error(400, "enabled must be true or false")
+        try:
+            self.watchdog.set_profiling(body["enabled"])
+        except RuntimeError as e:
+            return error(501, str(e))
+        return web.json_response({"profiling": self.watchdog.profiling, "samples": self.watchdog.samples})
@@ -0,0 +1,87 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque
+
+# Admission configuration from environment variables with fallbacks
+# Handshakes processed at the same time
+MAX_CONCURRENT_HANDSHAKES = int(os.environ.get("MAX_CONCURRENT_HANDSHAKES", "32"))
+# Handshakes waiting for a slot, anything beyond is rejected right away
+HANDSHAKE_QUEUE_SIZE = int(os.environ.get("HANDSHAKE_QUEUE_SIZE", "512"))
+# Seconds a handshake may wait for a slot before it is rejected
+HANDSHAKE_QUEUE_TIMEOUT = float(os.environ.get("HANDSHAKE_QUEUE_TIMEOUT", "5"))
+
+# Shortest retry-after hint given to rejected clients, in seconds
+MIN_RETRY_AFTER = 1.0
+# Weight of the latest handshake in the running average of handshake durations
+DURATION_SMOOTHING = 0.1
+
+
+class AdmissionControl:
+    """Bounds the number of concurrent handshakes.
+
+    Handshakes beyond the limit wait in a FIFO queue for at most `timeout` seconds. When the queue is
+    full or the wait times out the handshake is rejected, and retry_after() tells the client how long
+    the current backlog should take to clear.
+    """
+
+    def __init__(self, limit: int = MAX_CONCURRENT_HANDSHAKES, queue_size: int = HANDSHAKE_QUEUE_SIZE,
+                 timeout: float = HANDSHAKE_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # Running average of how long a handshake holds its slot
+        self.average_duration = 0.01
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    async def acquire(self) -> bool:
+        """Wait for a handshake slot; returns False if the handshake should be rejected."""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            # release() may have handed us the slot just as the deadline passed
+            if waiter.done() and not waiter.cancelled():
+                return True
+            return False
+        except asyncio.CancelledError:
+            # The handshake went away; pass on a slot that was handed to it meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self._hand_over()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self, started_at: float):
+        """Free a slot taken by acquire(), handing it straight to the oldest waiting handshake."""
+        duration = time.monotonic() - started_at
+        self.average_duration += DURATION_SMOOTHING * (duration - self.average_duration)
+        self._hand_over()
+
+    def _hand_over(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> float:
+        """Seconds until the handshakes already waiting should have gone through."""
+        return max(MIN_RETRY_AFTER, (len(self.waiters) + self.active) * self.average_duration / self.limit)
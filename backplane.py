@@ -0,0 +1,386 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""Pub/sub and lease store shared by server replicas.
+
+A backplane gives every replica the same message stream and a small key-value store with expiring
+entries, which is all the cluster needs for command dispatch, membership and leader election.
+
+- LocalBackplane keeps everything in memory. Replicas in one process share a LocalBus, which is also
+  the default for a single replica.
+- SocketBackplane talks to a BackplaneHub over TCP (JSON lines). Run the hub with
+  `python backplane.py --port 8766` and point replicas at it with BACKPLANE_URL=tcp://host:8766.
+"""
+import asyncio
+import argparse
+import itertools
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from log import log_event, setup_logging
+
+logger = logging.getLogger("muppet.backplane")
+
+Handler = Callable[[dict], Awaitable[None]]
+
+# Seconds between attempts to reach the hub
+RECONNECT_DELAY = 1.0
+# Seconds to wait for the hub to answer a request
+REQUEST_TIMEOUT = 2.0
+
+
+class LocalBus:
+    """The shared state behind LocalBackplane and BackplaneHub."""
+
+    def __init__(self):
+        self.subscribers: List[asyncio.Queue] = []
+        self.values: Dict[str, Tuple[Any, float]] = {}
+
+    def attach(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        return queue
+
+    def detach(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def publish(self, message: dict):
+        for queue in self.subscribers:
+            queue.put_nowait(message)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.values[key] = (value, time.monotonic() + ttl)
+
+    def get(self, key: str) -> Any:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self.values.items() if expires_at < now]:
+            del self.values[key]
+        return {key: value for key, (value, _) in self.values.items() if key.startswith(prefix)}
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """Take or renew a lease; fails while somebody else holds it."""
+        holder = self.get(key)
+        if holder is not None and holder != owner:
+            return False
+        self.set(key, owner, ttl)
+        return True
+
+    def release(self, key: str, owner: str):
+        if self.get(key) == owner:
+            del self.values[key]
+
+    def delete(self, key: str):
+        self.values.pop(key, None)
+
+
+class Backplane:
+    """Interface shared by the backplane implementations."""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, handler: Handler):
+        """Call handler for every published message, in order, including our own."""
+        raise NotImplementedError
+
+    async def publish(self, message: dict):
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Any:
+        """Return the value of a live entry, or None."""
+        raise NotImplementedError
+
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        """Return all live entries whose key starts with prefix."""
+        raise NotImplementedError
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    async def release(self, key: str, owner: str):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+
+class LocalBackplane(Backplane):
+    def __init__(self, bus: Optional[LocalBus] = None):
+        self.bus = bus if bus is not None else LocalBus()
+        self.queues: List[asyncio.Queue] = []
+        self.tasks: List[asyncio.Task] = []
+
+    def subscribe(self, handler: Handler):
+        queue = self.bus.attach()
+        self.queues.append(queue)
+        self.tasks.append(asyncio.create_task(_dispatch(queue, handler)))
+
+    async def stop(self):
+        for queue in self.queues:
+            self.bus.detach(queue)
+        for task in self.tasks:
+            task.cancel()
+        self.queues.clear()
+        self.tasks.clear()
+
+    async def publish(self, message: dict):
+        self.bus.publish(message)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self.bus.set(key, value, ttl)
+
+    async def get(self, key: str) -> Any:
+        return self.bus.get(key)
+
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        return self.bus.scan(prefix)
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return self.bus.acquire(key, owner, ttl)
+
+    async def release(self, key: str, owner: str):
+        self.bus.release(key, owner)
+
+    async def delete(self, key: str):
+        self.bus.delete(key)
+
+
+async def _dispatch(queue: asyncio.Queue, handler: Handler):
+    while True:
+        message = await queue.get()
+        try:
+            await handler(message)
+        except Exception as e:
+            log_event(logger, "backplane_handler_error", "Backplane handler failed: %s", e, level=logging.ERROR)
+
+
+class SocketBackplane(Backplane):
+    """Client of a BackplaneHub. Reconnects on its own; requests fail fast while the hub is unreachable."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.handlers: List[Handler] = []
+        # Created in start(): the server builds its backplane at import time, and on Python 3.9 queues and
+        # events bind to the loop current when they are created, not the one asyncio.run() starts later
+        self.inbox: Optional[asyncio.Queue] = None
+        self.connected: Optional[asyncio.Event] = None
+        self.requests: Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count(1)
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self.inbox = asyncio.Queue()
+        self.connected = asyncio.Event()
+        self.tasks.append(asyncio.create_task(self._connection_loop()))
+        self.tasks.append(asyncio.create_task(self._dispatch_loop()))
+        try:
+            await asyncio.wait_for(self.connected.wait(), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            log_event(logger, "backplane_unreachable", "Backplane hub %s:%s not reachable yet", self.host, self.port,
+                      level=logging.WARNING)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+    def subscribe(self, handler: Handler):
+        self.handlers.append(handler)
+
+    async def _connection_loop(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                log_event(logger, "backplane_connect_failed", "Cannot reach backplane hub: %s", e,
+                          level=logging.WARNING, sampled=True)
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self.writer = writer
+            self.connected.set()
+            log_event(logger, "backplane_connected", "Connected to backplane hub %s:%s", self.host, self.port)
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    reply = json.loads(line)
+                    if "req" in reply:
+                        future = self.requests.pop(reply["req"], None)
+                        if future is not None and not future.done():
+                            future.set_result(reply.get("result"))
+                    else:
+                        self.inbox.put_nowait(reply["message"])
+            except (ConnectionError, ValueError) as e:
+                log_event(logger, "backplane_error", "Backplane connection failed: %s", e, level=logging.WARNING)
+            finally:
+                self.connected.clear()
+                self.writer = None
+                writer.close()
+                for future in self.requests.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("backplane connection lost"))
+                self.requests.clear()
+            log_event(logger, "backplane_disconnected", "Lost backplane hub connection, reconnecting",
+                      level=logging.WARNING)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _dispatch_loop(self):
+        while True:
+            message = await self.inbox.get()
+            for handler in self.handlers:
+                try:
+                    await handler(message)
+                except Exception as e:
+                    log_event(logger, "backplane_handler_error", "Backplane handler failed: %s", e, level=logging.ERROR)
+
+    def _send(self, payload: dict):
+        if self.writer is None:
+            raise ConnectionError("backplane hub not connected")
+        self.writer.write(json.dumps(payload).encode() + b"\n")
+
+    async def _request(self, payload: dict) -> Any:
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.requests[request_id] = future
+        try:
+            self._send({**payload, "req": request_id})
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self.requests.pop(request_id, None)
+
+    async def publish(self, message: dict):
+        self._send({"op": "publish", "message": message})
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._send({"op": "set", "key": key, "value": value, "ttl": ttl})
+
+    async def get(self, key: str) -> Any:
+        return await self._request({"op": "get", "key": key})
+
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        return await self._request({"op": "scan", "prefix": prefix})
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return await self._request({"op": "acquire", "key": key, "owner": owner, "ttl": ttl})
+
+    async def release(self, key: str, owner: str):
+        self._send({"op": "release", "key": key, "owner": owner})
+
+    async def delete(self, key: str):
+        self._send({"op": "delete", "key": key})
+
+
+class BackplaneHub:
+    """TCP server relaying messages between SocketBackplane clients and holding the shared store."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.bus = LocalBus()
+        self.server: Optional[asyncio.base_events.Server] = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log_event(logger, "hub_started", "Backplane hub listening on %s:%s", self.host, self.port)
+        return self.port
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        queue = self.bus.attach()
+        forwarder = asyncio.create_task(self._forward(queue, writer))
+        peer = writer.get_extra_info("peername")
+        log_event(logger, "hub_client_connected", "Replica connected from %s", peer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                result = self._execute(request)
+                if "req" in request:
+                    writer.write(json.dumps({"req": request["req"], "result": result}).encode() + b"\n")
+        except (ConnectionError, ValueError) as e:
+            log_event(logger, "hub_client_error", "Replica connection failed: %s", e, level=logging.WARNING)
+        finally:
+            self.bus.detach(queue)
+            forwarder.cancel()
+            writer.close()
+            log_event(logger, "hub_client_disconnected", "Replica from %s disconnected", peer)
+
+    def _execute(self, request: dict) -> Any:
+        op = request.get("op")
+        if op == "publish":
+            self.bus.publish(request["message"])
+        elif op == "set":
+            self.bus.set(request["key"], request["value"], request["ttl"])
+        elif op == "get":
+            return self.bus.get(request["key"])
+        elif op == "scan":
+            return self.bus.scan(request["prefix"])
+        elif op == "acquire":
+            return self.bus.acquire(request["key"], request["owner"], request["ttl"])
+        elif op == "release":
+            self.bus.release(request["key"], request["owner"])
+        elif op == "delete":
+            self.bus.delete(request["key"])
+        return None
+
+    async def _forward(self, queue: asyncio.Queue, writer: asyncio.StreamWriter):
+        while True:
+            message = await queue.get()
+            writer.write(json.dumps({"message": message}).encode() + b"\n")
+            await writer.drain()
+
+
+def create_backplane(url: str) -> Backplane:
+    """Build a backplane from BACKPLANE_URL: empty or memory:// for in-process, tcp://host:port for a hub."""
+    if not url or url.startswith("memory:"):
+        return LocalBackplane()
+    parsed = urlparse(url)
+    if parsed.scheme == "tcp":
+        return SocketBackplane(parsed.hostname or "localhost", parsed.port or 8766)
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+
+async def run_hub(host: str, port: int):
+    hub = BackplaneHub(host, port)
+    await hub.start()
+    try:
+        await asyncio.Future()  # Run forever
+    finally:
+        await hub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backplane hub for server replicas')
+    parser.add_argument('--host', default="0.0.0.0", help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8766, help='Port to listen on')
+    args = parser.parse_args()
+    setup_logging()
+    asyncio.run(run_hub(args.host, args.port))
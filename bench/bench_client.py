@@ -0,0 +1,183 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""Seek latency benchmark for client.py against the in-process fake VLC.
+
+Measures the latency of single rc commands, of parse_timecode and get_video_duration, and how many
+/seek commands per second go through connect_to_server's handling path, from a websocket message to
+the "seeked" reply. No VLC or Telegram needed.
+
+    python bench/bench_client.py --delay 0.005 --seeks 500 --json results.json
+"""
+import asyncio
+import argparse
+import json
+import os
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client  # noqa: E402
+from fake_vlc import FakeVLC  # noqa: E402
+from bench_server import percentiles  # noqa: E402
+
+
+async def time_calls(count, call):
+    """Await call() count times one after another and return the latencies."""
+    latencies = []
+    for _ in range(count):
+        started = time.monotonic()
+        await call()
+        latencies.append(time.monotonic() - started)
+    return latencies
+
+
+async def count_wrong_lengths(count, length):
+    """How many of count get_length answers were not the video length, e.g. mixed up with status lines."""
+    host, port = client.DEFAULT_VLC_CONNECT_HOST, client.DEFAULT_VLC_PORT
+    wrong = 0
+    for _ in range(count):
+        if await client.send_command_to_vlc("get_length", host, port) != str(length):
+            wrong += 1
+    return wrong
+
+
+async def bench_commands(count):
+    host, port = client.DEFAULT_VLC_CONNECT_HOST, client.DEFAULT_VLC_PORT
+    return {
+        "get_length": percentiles(await time_calls(count, lambda: client.send_command_to_vlc("get_length", host, port))),
+        "get_time": percentiles(await time_calls(count, lambda: client.send_command_to_vlc("get_time", host, port))),
+        "seek": percentiles(await time_calls(count, lambda: client.send_command_to_vlc("seek 60", host, port))),
+        "get_video_duration": percentiles(await time_calls(count, lambda: client.get_video_duration(host, port))),
+        "parse_timecode hh:mm:ss": percentiles(await time_calls(count, lambda: client.parse_timecode("00:10:00", host, port))),
+        "parse_timecode %": percentiles(await time_calls(count, lambda: client.parse_timecode("50%", host, port))),
+        "parse_timecode -1": percentiles(await time_calls(count, lambda: client.parse_timecode("-1", host, port))),
+    }
+
+
+async def bench_seeks(count, timecode, burst):
+    """Send /seek commands to connect_to_server and wait for the reply to every one of them.
+
+    With burst the commands go out back to back, otherwise each waits for the previous reply. In a
+    burst the client only runs the latest seek and answers the ones it replaced with "superseded",
+    so latencies cover the seeks that ran and superseded counts the rest.
+    """
+    replies = asyncio.Queue()
+    done = asyncio.Event()
+    results = {}
+
+    async def handler(websocket):
+        await websocket.recv()  # handshake
+        await websocket.send("Authentication successful!")
+
+        async def read_replies():
+            async for message in websocket:
+                if message.startswith("/time "):
+                    await websocket.send(f"{message} {time.monotonic():.6f}")
+                elif message.startswith(("seeked", "superseded", "seek_failed")):
+                    await replies.put((message, time.monotonic()))
+
+        reader = asyncio.create_task(read_replies())
+        latencies = []
+        superseded = 0
+        started = time.monotonic()
+        if burst:
+            sent = {}
+            for command_id in range(1, count + 1):
+                sent[str(command_id)] = time.monotonic()
+                await websocket.send(f"/seek {timecode} #{command_id}")
+            for _ in range(count):
+                message, received_at = await replies.get()
+                if message.startswith("superseded"):
+                    superseded += 1
+                else:
+                    latencies.append(received_at - sent[message.rpartition(" #")[2]])
+        else:
+            for command_id in range(1, count + 1):
+                sent_at = time.monotonic()
+                await websocket.send(f"/seek {timecode} #{command_id}")
+                _, received_at = await replies.get()
+                latencies.append(received_at - sent_at)
+        elapsed = time.monotonic() - started
+        results.update(percentiles(latencies))
+        results["seeks_per_second"] = count / elapsed
+        results["superseded"] = superseded
+        reader.cancel()
+        done.set()
+        await websocket.close()
+
+    async with websockets.serve(handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        connection = asyncio.create_task(client.connect_to_server("seeker", "token", f"ws://127.0.0.1:{port}"))
+        await done.wait()
+        await connection
+    return results
+
+
+def print_table(title, rows):
+    print(title)
+    for name, stats in rows.items():
+        extra = f"  {stats['seeks_per_second']:.0f} seeks/s" if "seeks_per_second" in stats else ""
+        if stats.get("superseded"):
+            extra += f", {stats['superseded']} superseded"
+        print(f"  {name:<26} p50 {stats['p50_ms']:7.2f}ms  p95 {stats['p95_ms']:7.2f}ms  "
+              f"p99 {stats['p99_ms']:7.2f}ms  max {stats['max_ms']:7.2f}ms{extra}")
+
+
+async def run(args):
+    vlc = FakeVLC(length=args.length, delay=args.delay, jitter=args.jitter, status_interval=args.status_interval)
+    client.DEFAULT_VLC_CONNECT_HOST = "127.0.0.1"
+    client.DEFAULT_VLC_PORT = await vlc.start()
+    try:
+        results = {"delay_ms": args.delay * 1000, "jitter_ms": args.jitter * 1000}
+        results["commands"] = await bench_commands(args.commands)
+        results["wrong_lengths"] = await count_wrong_lengths(args.commands, args.length)
+        results["seek_handling"] = {
+            "sequential": await bench_seeks(args.seeks, args.timecode, burst=False),
+            "burst": await bench_seeks(args.seeks, args.timecode, burst=True),
+        }
+        results["vlc_commands"] = vlc.commands
+    finally:
+        await vlc.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client seek latency benchmark')
+    parser.add_argument('--delay', type=float, default=0.005, help='Fake VLC response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random response delay in seconds')
+    parser.add_argument('--length', type=int, default=3600, help='Fake video length in seconds')
+    parser.add_argument('--status-interval', type=float, default=0.05,
+                        help='Seconds between the unprompted status change lines of the fake VLC, 0 for none')
+    parser.add_argument('--commands', type=int, default=200, help='Calls per command benchmark')
+    parser.add_argument('--seeks', type=int, default=200, help='/seek messages per handling benchmark')
+    parser.add_argument('--timecode', default="50%", help='Timecode sent with /seek')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show client output')
+    args = parser.parse_args()
+
+    if args.verbose:
+        results = asyncio.run(run(args))
+    else:
+        # client.py logs every command, keep it out of the report
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                results = asyncio.run(run(args))
+            finally:
+                sys.stdout = stdout
+
+    print(f"Fake VLC delay {args.delay * 1000:.1f}ms (+{args.jitter * 1000:.1f}ms jitter)")
+    print_table("Commands", results["commands"])
+    if results["wrong_lengths"]:
+        print(f"  {results['wrong_lengths']} of {args.commands} get_length answers were not the video length")
+    print_table(f"/seek {args.timecode} through connect_to_server", results["seek_handling"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""Load test for server.py with simulated seeker and switcher fleets.
+
+The server runs in a child process with a stub in place of the Telegram Application, so the benchmark
+works offline. Clients connect with the usual TOKEN:type:host handshake, confirm commands the way
+client.py does, and record when each broadcast reaches them. Broadcasts are triggered over the child's
+stdin, which answers with JSON lines on stderr (its regular output goes to stdout).
+
+    python bench/bench_server.py --seekers 1000 --switchers 200 --rounds 20 --json results.json
+"""
+import asyncio
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+AUTH_TOKEN = "bench_token"
+
+
+def raise_fd_limit():
+    """Thousands of sockets need more file descriptors than the usual soft limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def process_usage(pid):
+    """Return (RSS bytes, CPU seconds) of a process from /proc, or (None, None) where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        return rss, cpu
+    except (OSError, StopIteration):
+        return None, None
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50_ms": pick(0.5) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+# Server side: runs in the child process
+
+class StubBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text):
+        self.sent += 1
+
+
+class StubApplication:
+    """Stands in for telegram.ext.Application; only the bot used for notifications is needed."""
+
+    def __init__(self):
+        self.bot = StubBot()
+
+
+async def serve(port):
+    import server
+
+    server.HOST = "127.0.0.1"
+    server.PORT = port
+    server.AUTH_TOKEN = AUTH_TOKEN
+    server.AUTHORIZED_CHAT_ID = 1
+    server.application = StubApplication()
+    server.setup_logging()
+    server.notifications.start()
+    server.websocket_server = await server.start_websocket_server()
+
+    def reply(**fields):
+        sys.stderr.write(json.dumps(fields) + "\n")
+        sys.stderr.flush()
+
+    reply(event="ready", pid=os.getpid())
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line or line == "quit":
+            break
+        if line in ("seek", "switch"):
+            dispatched_at = time.monotonic()
+            if line == "seek":
+                due_at = dispatched_at + server.SEEK_LEAD_TIME
+                command = await server.broadcast_to_random_seekers("/seek 0", due_at)
+            else:
+                command = await server.broadcast_to_clients_by_type("/switch", server.CLIENT_TYPE_SWITCHER)
+            fan_out = time.monotonic() - dispatched_at
+            if command:
+                await server.commands.wait(command)
+            reply(event=line, dispatched_at=dispatched_at, fan_out=fan_out,
+                  command_id=command.id if command else None,
+                  recipients=len(command.expected) if command else 0,
+                  confirmed=len(command.latencies) if command else 0)
+        elif line == "stats":
+            reply(event="stats", clients={t: len(c) for t, c in server.clients.items()},
+                  notifications_sent=server.application.bot.sent)
+
+    await server.notifications.stop()
+    server.websocket_server.close()
+    await server.websocket_server.wait_closed()
+
+
+# Client side: runs in the benchmark process
+
+class SimulatedClient:
+    def __init__(self, client_type, host):
+        self.client_type = client_type
+        self.host = host
+        self.received = {}
+        self.websocket = None
+        self.task = None
+
+    async def connect(self, url):
+        self.websocket = await websockets.connect(url, open_timeout=60, ping_interval=None)
+        await self.websocket.send(f"{AUTH_TOKEN}:{self.client_type}:{self.host}")
+        await self.websocket.recv()
+        self.task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        try:
+            async for message in self.websocket:
+                received_at = time.monotonic()
+                if message.startswith("/time "):
+                    continue
+                command, _, command_id = message.partition(" #")
+                if command_id:
+                    self.received[int(command_id)] = received_at
+                if command.startswith("/seek "):
+                    await self.websocket.send(f"seeked 0 of 0 #{command_id}")
+                elif command == "/switch":
+                    await self.websocket.send(f"switched #{command_id}")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def close(self):
+        if self.websocket:
+            await self.websocket.close()
+        if self.task:
+            await self.task
+
+
+async def connect_fleet(url, client_type, count, concurrency):
+    """Connect count clients with at most `concurrency` handshakes in flight; returns (clients, failures)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    fleet = []
+    failures = 0
+
+    async def connect_one(index):
+        nonlocal failures
+        client = SimulatedClient(client_type, f"bench-{client_type}-{index}")
+        async with semaphore:
+            try:
+                await client.connect(url)
+                fleet.append(client)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(connect_one(i) for i in range(count)))
+    return fleet, failures
+
+
+async def run(args):
+    raise_fd_limit()
+    child = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port),
+        stdin=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        stdout=None if args.verbose else asyncio.subprocess.DEVNULL,
+        limit=1 << 20,
+    )
+
+    # Keep draining the pipe so the server never blocks on a write
+    events = asyncio.Queue()
+
+    async def pump():
+        while True:
+            line = await child.stderr.readline()
+            if not line:
+                await events.put(None)
+                return
+            try:
+                await events.put(json.loads(line))
+            except ValueError:
+                # Tracebacks and other stray output
+                print(line.decode().rstrip(), file=sys.stderr)
+
+    pump_task = asyncio.create_task(pump())
+
+    async def read_event(expected):
+        while True:
+            event = await events.get()
+            if event is None:
+                raise RuntimeError("server process exited")
+            if event.get("event") == expected:
+                return event
+
+    async def request(command):
+        child.stdin.write(f"{command}\n".encode())
+        await child.stdin.drain()
+        return await read_event(command)
+
+    results = {"seekers": args.seekers, "switchers": args.switchers, "rounds": args.rounds}
+    try:
+        ready = await read_event("ready")
+        pid = ready["pid"]
+        url = f"ws://127.0.0.1:{args.port}"
+        rss_idle, cpu_idle = process_usage(pid)
+
+        started = time.monotonic()
+        seekers, seeker_failures = await connect_fleet(url, "seeker", args.seekers, args.concurrency)
+        switchers, switcher_failures = await connect_fleet(url, "switcher", args.switchers, args.concurrency)
+        setup = time.monotonic() - started
+        connected = len(seekers) + len(switchers)
+        rss_connected, cpu_connected = process_usage(pid)
+        results["connect"] = {
+            "connected": connected,
+            "failed": seeker_failures + switcher_failures,
+            "seconds": setup,
+            "per_second": connected / setup if setup else None,
+            "server_cpu_seconds": cpu_connected - cpu_idle if cpu_idle is not None else None,
+        }
+        if rss_idle is not None and connected:
+            results["memory"] = {
+                "idle_rss_mb": rss_idle / 2 ** 20,
+                "connected_rss_mb": rss_connected / 2 ** 20,
+                "bytes_per_connection": (rss_connected - rss_idle) / connected,
+            }
+
+        for kind, fleet in (("seek", seekers), ("switch", switchers)):
+            if not fleet:
+                continue
+            latencies, fan_outs, confirmed, recipients = [], [], 0, 0
+            cpu_before = process_usage(pid)[1]
+            for _ in range(args.rounds):
+                event = await request(kind)
+                fan_outs.append(event["fan_out"])
+                confirmed += event["confirmed"]
+                recipients += event["recipients"]
+                command_id = event["command_id"]
+                latencies.extend(
+                    client.received[command_id] - event["dispatched_at"]
+                    for client in fleet if command_id in client.received
+                )
+                if args.interval:
+                    await asyncio.sleep(args.interval)
+            cpu_after = process_usage(pid)[1]
+            results[kind] = {
+                "delivery": percentiles(latencies),
+                "server_fan_out": percentiles(fan_outs),
+                "recipients": recipients,
+                "confirmed": confirmed,
+                "server_cpu_seconds": cpu_after - cpu_before if cpu_before is not None else None,
+            }
+
+        results["server"] = await request("stats")
+        await asyncio.gather(*(client.close() for client in seekers + switchers))
+    finally:
+        if child.returncode is None:
+            child.stdin.write(b"quit\n")
+            try:
+                await asyncio.wait_for(child.wait(), 10)
+            except asyncio.TimeoutError:
+                child.kill()
+        pump_task.cancel()
+    return results
+
+
+def print_report(results):
+    connect = results["connect"]
+    print(f"Connected {connect['connected']} clients ({connect['failed']} failed) in {connect['seconds']:.2f}s "
+          f"= {connect['per_second']:.0f} handshakes/s")
+    if "memory" in results:
+        memory = results["memory"]
+        print(f"Server RSS {memory['idle_rss_mb']:.1f} MB idle, {memory['connected_rss_mb']:.1f} MB connected, "
+              f"{memory['bytes_per_connection'] / 1024:.1f} KB per connection")
+    for kind in ("seek", "switch"):
+        if kind not in results:
+            continue
+        stats = results[kind]
+        delivery = stats["delivery"]
+        fan_out = stats["server_fan_out"]
+        print(f"/{kind}: {stats['confirmed']} of {stats['recipients']} deliveries confirmed")
+        if delivery:
+            print(f"  delivery   p50 {delivery['p50_ms']:.1f}ms  p95 {delivery['p95_ms']:.1f}ms  "
+                  f"p99 {delivery['p99_ms']:.1f}ms  max {delivery['max_ms']:.1f}ms")
+        print(f"  fan-out    p50 {fan_out['p50_ms']:.1f}ms  p95 {fan_out['p95_ms']:.1f}ms  max {fan_out['max_ms']:.1f}ms")
+        if stats["server_cpu_seconds"] is not None:
+            print(f"  server CPU {stats['server_cpu_seconds']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server load test')
+    parser.add_argument('--seekers', type=int, default=1000, help='Simulated seeker clients')
+    parser.add_argument('--switchers', type=int, default=100, help='Simulated switcher clients')
+    parser.add_argument('--rounds', type=int, default=10, help='Broadcasts of each command')
+    parser.add_argument('--interval', type=float, default=0.0, help='Seconds between broadcasts')
+    parser.add_argument('--concurrency', type=int, default=200, help='Handshakes in flight while connecting')
+    parser.add_argument('--port', type=int, default=18765, help='Port for the benchmarked server')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show server output')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        raise_fd_limit()
+        asyncio.run(serve(args.port))
+        return
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""Stand-in for the Telegram Bot API, to try the server's webhook mode (and its polling fallback) offline.
+
+Answers getMe, setWebhook, deleteWebhook, getUpdates and sendMessage, and posts fake updates to the
+webhook the server registered, or hands them out through getUpdates while the server polls. Run the
+server against it with TELEGRAM_API_URL set to base_url:
+
+    telegram = FakeTelegram()
+    base_url = await telegram.start()
+    ...
+    posted_at = await telegram.post_update("/seek 50%")
+    reply = await telegram.wait_for_message()
+    await telegram.stop()
+
+Run as a script it posts every line typed on stdin as a command and prints the bot's replies:
+
+    python bench/fake_telegram.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot WEBHOOK_URL=http://127.0.0.1:8080/telegram python server.py
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from aiohttp import ClientSession, web
+
+WEBHOOK_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Muppet", "username": "muppet_bot"}
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0, refuse_webhook=False):
+        self.host = host
+        self.port = port
+        # Answer setWebhook like Telegram does for a URL it does not accept, to exercise the polling fallback
+        self.refuse_webhook = refuse_webhook
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.pending = []
+        self.pending_ready = asyncio.Event()
+        self.sent = asyncio.Queue()
+        self.calls = {}
+        self.update_ids = 0
+        self.message_ids = 0
+        self.runner = None
+        self.session = None
+
+    async def start(self):
+        """Start listening; returns the base URL for TELEGRAM_API_URL."""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+        self.session = ClientSession()
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def stop(self):
+        if self.session:
+            await self.session.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post()) if request.content_type != "application/json" else await request.json()
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method == "setWebhook":
+            if self.refuse_webhook:
+                return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: bad webhook: HTTPS url must be provided for webhook"},
+                                         status=400)
+            self.webhook_url = params.get("url")
+            self.webhook_secret = params.get("secret_token")
+            return self._ok(True)
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return self._ok(True)
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0)))
+        if method == "sendMessage":
+            self.message_ids += 1
+            chat_id = int(params["chat_id"])
+            await self.sent.put((time.monotonic(), chat_id, params["text"]))
+            return self._ok({"message_id": self.message_ids, "date": int(time.time()),
+                             "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": params["text"]})
+        return self._ok(True)
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, offset, timeout):
+        self.pending = [update for update in self.pending if update["update_id"] >= offset]
+        if not self.pending:
+            self.pending_ready.clear()
+            try:
+                # Long poll, like the real thing
+                await asyncio.wait_for(self.pending_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.pending)
+
+    def make_update(self, text, chat_id=1):
+        self.update_ids += 1
+        self.message_ids += 1
+        command = text.split()[0]
+        message = {
+            "message_id": self.message_ids,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Tester"},
+            "text": text,
+        }
+        if command.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": self.update_ids, "message": message}
+
+    async def post_update(self, text, chat_id=1):
+        """Send a message to the bot, through the webhook if one is set; returns the monotonic time it was sent."""
+        update = self.make_update(text, chat_id)
+        posted_at = time.monotonic()
+        if self.webhook_url:
+            headers = {WEBHOOK_SECRET_HEADER: self.webhook_secret or ""}
+            async with self.session.post(self.webhook_url, json=update, headers=headers) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"Webhook answered {response.status}")
+        else:
+            self.pending.append(update)
+            self.pending_ready.set()
+        return posted_at
+
+    async def wait_for_message(self, timeout=10):
+        """The next message the bot sent, as (monotonic time, chat ID, text)."""
+        return await asyncio.wait_for(self.sent.get(), timeout)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API that posts the commands typed on stdin")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--refuse-webhook", action="store_true", help="Refuse setWebhook so the server falls back to polling")
+    args = parser.parse_args()
+
+    telegram = FakeTelegram(args.host, args.port, args.refuse_webhook)
+    base_url = await telegram.start()
+    print(f"Fake Bot API on {base_url}, start the server with TELEGRAM_API_URL={base_url}", file=sys.stderr)
+
+    async def print_replies():
+        while True:
+            sent_at, chat_id, text = await telegram.sent.get()
+            print(json.dumps({"at": sent_at, "chat_id": chat_id, "text": text}))
+
+    printer = asyncio.create_task(print_replies())
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            if line.strip():
+                await telegram.post_update(line.strip(), args.chat_id)
+                print(f"Posted {line.strip()} via {'webhook' if telegram.webhook_url else 'getUpdates'}", file=sys.stderr)
+    finally:
+        printer.cancel()
+        await telegram.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
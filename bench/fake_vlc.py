@@ -0,0 +1,103 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""In-process stand-in for the VLC rc interface.
+
+Speaks enough of the protocol for client.py: a banner followed by the "> " prompt, and the get_length,
+get_time, seek, is_playing and pause commands, each answered after a configurable delay. Commands on one
+connection are answered in order, one at a time, like VLC does. Every status_interval seconds it also
+prints the unprompted "status change:" lines VLC prints when --loop restarts the video.
+
+    vlc = FakeVLC(length=5400, delay=0.02)
+    port = await vlc.start()
+    ...
+    await vlc.stop()
+"""
+import asyncio
+import random
+import time
+
+BANNER = b"VLC media player 3.0.20 Vetinari\r\nCommand Line Interface initialized. Type `help' for help.\r\n"
+PROMPT = b"> "
+STATUS_CHANGES = b"status change: ( new input: file:///home/pi/video.mp4 )\r\nstatus change: ( play state: 3 ): Play\r\n"
+
+
+class FakeVLC:
+    def __init__(self, length=3600, delay=0.0, jitter=0.0, host="127.0.0.1", port=0, status_interval=0.0):
+        self.length = length
+        self.status_interval = status_interval
+        self.delay = delay
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self.position = 0.0
+        self.position_at = time.monotonic()
+        self.playing = True
+        self.commands = 0
+        self.server = None
+
+    async def start(self):
+        """Start listening; returns the port (a free one is picked when port is 0)."""
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def current_time(self):
+        if self.playing:
+            return (self.position + time.monotonic() - self.position_at) % self.length
+        return self.position
+
+    async def _announce_restarts(self, writer):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            writer.write(STATUS_CHANGES)
+
+    async def _handle(self, reader, writer):
+        writer.write(BANNER + PROMPT)
+        announcer = asyncio.create_task(self._announce_restarts(writer)) if self.status_interval else None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.execute(line.decode("utf-8", "replace").strip())
+                writer.write(response.encode("utf-8") + PROMPT)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if announcer is not None:
+                announcer.cancel()
+            writer.close()
+
+    async def execute(self, command):
+        """Run one rc command and return its output, including the trailing newline if any."""
+        delay = self.delay + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        self.commands += 1
+        name, _, argument = command.partition(" ")
+        if name == "get_length":
+            return f"{self.length}\r\n"
+        if name == "get_time":
+            return f"{int(self.current_time())}\r\n"
+        if name == "is_playing":
+            return f"{int(self.playing)}\r\n"
+        if name == "seek":
+            if argument.isdigit():
+                self.position = min(int(argument), self.length)
+                self.position_at = time.monotonic()
+            return ""
+        if name == "pause":
+            self.position = self.current_time()
+            self.position_at = time.monotonic()
+            self.playing = not self.playing
+            return ""
+        if not name:
+            return ""
+        return f"Unknown command `{name}'. Type `help' for help.\r\n"
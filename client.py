@@ -3,14 +3,17 @@
 import asyncio
 import argparse
 import websockets
+import mmap
 import os
 import sys
 import re
-import telnetlib
 import subprocess
 import time
 import random
 import socket
+import threading
+import traceback
+from collections import deque
 
 # Try to import configuration from config.py if it exists
 try:
@@ -32,22 +35,159 @@ except ImportError:
     DEFAULT_VLC_CONNECT_HOST = "localhost"
     DEFAULT_VLC_PORT = 4212
     DEFAULT_VIDEO_PATH = "/path/to/video.mp4"
+try:
+    # Older config files have no group, their clients join the server's default group
+    from config import GROUP as DEFAULT_GROUP
+except ImportError:
+    DEFAULT_GROUP = ""
 
 VLC_PROCESS: subprocess.Popen | None = None
-
-
-def send_command_to_vlc(command, host, port):
+# Set once VLC has loaded the video and made its initial jump; seeks from the server wait for it
+VLC_READY: asyncio.Event | None = None
+# Length of the video in seconds once VLC reported it, 0 before; the server gets it in the handshake
+VIDEO_DURATION = 0
+# Memory map of the video file used to page in the region around seek targets, see VideoPrefetcher
+VIDEO_PREFETCHER: "VideoPrefetcher | None" = None
+
+# Clock sync probes sent right after connecting, the best of them is kept
+CLOCK_SYNC_SAMPLES = 8
+# Seconds between the probes of the initial burst
+CLOCK_SYNC_BURST_INTERVAL = 0.1
+# Seconds between probes once the clock is synced
+CLOCK_SYNC_INTERVAL = 30
+# Seconds a scheduled seek waits for the first clock sync sample after connecting
+CLOCK_SYNC_WAIT = 1
+# Seconds between heartbeats, the server drops clients that stay silent for three of them
+HEARTBEAT_INTERVAL = 5
+# Reconnect delays grow exponentially from the base up to the cap; each retry waits a random part of that
+RECONNECT_BASE_DELAY = 0.25
+RECONNECT_MAX_DELAY = 30
+# Seconds between ticks of the event loop lag probe, and the lag past which the loop counts as stalled
+LOOP_LAG_INTERVAL = 0.1
+LOOP_STALL_THRESHOLD = 0.25
+
+
+# Seconds to wait for VLC to answer a single rc command
+VLC_COMMAND_TIMEOUT = 1
+# The rc interface prints this prompt after its banner and after every response
+VLC_PROMPT = b"> "
+# Unprompted lines the rc interface prints when the input or play state changes, e.g. every time --loop
+# restarts the video; they end up in front of the next response
+VLC_STATUS_CHANGE = "status change:"
+# Seconds between readiness polls while VLC starts, doubling from the first to the last
+VLC_READY_POLL_INITIAL = 0.05
+VLC_READY_POLL_MAX = 0.25
+# Seconds to keep polling before giving up on the initial jump; slow Pis with big files can take a while
+VLC_READY_TIMEOUT = 60
+
+# Seconds of video before and after a seek target paged in before VLC jumps there; byte offsets are
+# estimated from the average bitrate, so the window is generous and leans towards what plays next
+PREFETCH_BEFORE = 2
+PREFETCH_AFTER = 8
+# Evenly spaced positions warmed in the background once VLC is ready, and the seconds between them
+PREFETCH_WARM_POINTS = 10
+PREFETCH_WARM_INTERVAL = 1
+
+
+class VLCSession:
+    """Long-lived connection to the VLC rc interface.
+
+    Commands are written as soon as they are issued and a single reader task matches the
+    prompt-terminated responses to them in order, so several commands can be in flight at once.
+    The connection is opened lazily and reopened on the next command after it drops or VLC stops answering.
+    """
+
+    def __init__(self, host, port, timeout=VLC_COMMAND_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.reader_task: asyncio.Task | None = None
+        self.pending: deque[asyncio.Future] = deque()
+        self.connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        """Open the connection and wait for the first prompt."""
+        async with self.connect_lock:
+            if self.connected:
+                return
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            try:
+                await asyncio.wait_for(reader.readuntil(VLC_PROMPT), self.timeout)
+            except Exception:
+                writer.close()
+                raise
+            self.reader, self.writer = reader, writer
+            self.reader_task = asyncio.create_task(self._read_responses(reader))
+
+    async def _read_responses(self, reader):
+        try:
+            while True:
+                chunk = await reader.readuntil(VLC_PROMPT)
+                lines = chunk[:-len(VLC_PROMPT)].decode("utf-8", "replace").splitlines()
+                response = "\n".join(line for line in lines if not line.startswith(VLC_STATUS_CHANGE)).strip()
+                if self.pending:
+                    future = self.pending.popleft()
+                    # A command that already timed out still owns its slot in the queue
+                    if not future.done():
+                        future.set_result(response)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+            print(f"VLC connection lost: {e}")
+        finally:
+            if self.reader is reader:
+                self.close()
+
+    async def command(self, command):
+        """Send a command and return VLC's response, or None if it could not be delivered."""
+        try:
+            if not self.connected:
+                await self.connect()
+            future = asyncio.get_running_loop().create_future()
+            self.pending.append(future)
+            self.writer.write(command.encode("utf-8") + b"\n")
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            print(f"Timed out waiting for VLC to answer {command}, reconnecting")
+            self.close()
+            return None
+        except Exception as e:
+            print(f"Error sending command to VLC: {e}")
+            return None
+        print(f"VLC command {command} response: {response}")
+        return response
+
+    def close(self):
+        """Drop the connection and fail every command still waiting for a response."""
+        if self.writer is not None:
+            self.writer.close()
+        if self.reader_task is not None and self.reader_task is not asyncio.current_task():
+            self.reader_task.cancel()
+        self.reader = self.writer = self.reader_task = None
+        while self.pending:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_result(None)
+
+
+VLC_SESSIONS: dict[tuple[str, int], VLCSession] = {}
+
+
+def get_vlc_session(host, port):
+    """Return the shared rc session for a VLC instance, creating it on first use."""
+    session = VLC_SESSIONS.get((host, port))
+    if session is None:
+        session = VLC_SESSIONS[(host, port)] = VLCSession(host, port)
+    return session
+
+
+async def send_command_to_vlc(command, host, port):
     """Sends a command to VLC and returns the response."""
-    try:
-        with telnetlib.Telnet(host, port) as tn:
-            tn.read_until(b">", timeout=1)
-            tn.write(command.encode("utf-8") + b"\n")
-            response = tn.read_until(b">", timeout=1).decode("utf-8").strip().rstrip("> ").strip()
-            print(f"VLC command {command} response: {response}")
-            return response
-    except Exception as e:
-        print(f"Error sending command to VLC: {e}")
-        return None
+    return await get_vlc_session(host, port).command(command)
 
 
 def start_vlc(video_path, host, port):
@@ -64,16 +204,88 @@ def start_vlc(video_path, host, port):
     ]
 
     print(f"Starting VLC with video: {video_path}")
-    vlc_process = subprocess.Popen(vlc_command)
-    time.sleep(2)  # Give VLC some time to start
-
-    return vlc_process
-
-
-def get_video_duration(host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC_PORT):
+    return subprocess.Popen(vlc_command)
+
+
+class VideoPrefetcher:
+    """Keeps the video file memory-mapped and asks the kernel to read ahead around seek targets.
+
+    On SD cards a seek into a region that is not in the page cache stalls VLC, so the region is paged
+    in while the seek waits for its scheduled instant. The hints are asynchronous and best effort:
+    without madvise (or a mapping, e.g. for huge files on 32-bit Pis) posix_fadvise is used instead,
+    and platforms with neither skip them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.size = 0
+        try:
+            self.file = open(path, "rb")
+            self.size = os.fstat(self.file.fileno()).st_size
+        except OSError as e:
+            print(f"Not prefetching {path}: {e}")
+            return
+        try:
+            if self.size and hasattr(mmap, "MADV_WILLNEED"):
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            print(f"Could not map {path}, falling back to fadvise: {e}")
+
+    def warm(self, seconds, duration):
+        """Hint the kernel to read the bytes around the given position of a video of the given duration."""
+        if not self.size or not duration:
+            return
+        bytes_per_second = self.size / duration
+        start = max(0, int((seconds - PREFETCH_BEFORE) * bytes_per_second))
+        end = min(self.size, int((seconds + PREFETCH_AFTER) * bytes_per_second))
+        # madvise wants a page aligned start
+        start -= start % mmap.PAGESIZE
+        if end <= start:
+            return
+        try:
+            if self.map is not None:
+                self.map.madvise(mmap.MADV_WILLNEED, start, end - start)
+            elif hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(self.file.fileno(), start, end - start, os.POSIX_FADV_WILLNEED)
+        except (OSError, ValueError) as e:
+            print(f"Prefetch hint failed: {e}")
+
+    async def warm_targets(self, duration):
+        """Warm evenly spaced positions (0%, 10%, ...) one at a time, likely targets of percentage seeks."""
+        for point in range(PREFETCH_WARM_POINTS):
+            self.warm(duration * point / PREFETCH_WARM_POINTS, duration)
+            await asyncio.sleep(PREFETCH_WARM_INTERVAL)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.size = 0
+
+
+def prefetch(seconds):
+    """Page in the video around a seek target before VLC is told to jump there."""
+    if VIDEO_PREFETCHER is not None:
+        VIDEO_PREFETCHER.warm(seconds, VIDEO_DURATION)
+
+
+async def get_cached_duration(host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC_PORT):
+    """Return the video's duration, asking VLC only until it is known."""
+    global VIDEO_DURATION
+    if not VIDEO_DURATION:
+        VIDEO_DURATION = await get_video_duration(host, port)
+    return VIDEO_DURATION
+
+
+async def get_video_duration(host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC_PORT):
     """Get the duration of the currently playing video in seconds."""
     try:
-        response = send_command_to_vlc("get_length", host, port)
+        response = await send_command_to_vlc("get_length", host, port)
         if response and response.isdigit():
             return int(response)
         return 0
@@ -81,8 +293,60 @@ def get_video_duration(host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC_PORT)
         return 0
 
 
-def parse_timecode(timecode, host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC_PORT):
-    """Convert timecode format (hh:mm:ss, mm:ss or ss, xx% or -1) to seconds, supporting percentages and -1 for random."""
+async def wait_for_vlc(host, port, process=None):
+    """Poll the rc interface until VLC reports the video's length, with a short backoff.
+
+    Returns the duration in seconds, or 0 if VLC exited or did not get ready within VLC_READY_TIMEOUT.
+    """
+    session = get_vlc_session(host, port)
+    started = time.monotonic()
+    delay = VLC_READY_POLL_INITIAL
+    while time.monotonic() - started < VLC_READY_TIMEOUT:
+        if process is not None and process.poll() is not None:
+            print(f"VLC exited with code {process.returncode} while starting")
+            return 0
+        try:
+            # Connect quietly first, the rc port only opens once VLC is up
+            await session.connect()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        else:
+            # The length stays 0 until VLC has parsed the video
+            duration = await get_video_duration(host, port)
+            if duration > 0:
+                print(f"VLC ready after {time.monotonic() - started:.2f} seconds")
+                return duration
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, VLC_READY_POLL_MAX)
+    print(f"VLC not ready after {VLC_READY_TIMEOUT} seconds")
+    return 0
+
+
+async def prepare_vlc(process):
+    """Wait for VLC to load the video, jump to a random position, then let seeks from the server through."""
+    global VIDEO_DURATION
+    try:
+        duration = await wait_for_vlc(DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT, process)
+        if duration > 0:
+            VIDEO_DURATION = duration
+            # Seek to a random position between 0 and 80% of the video
+            random_position = random.randint(0, int(duration * 0.8))
+            print(f"Seeking to random position: {random_position} seconds")
+            prefetch(random_position)
+            await send_command_to_vlc(f"seek {random_position}", DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT)
+    finally:
+        VLC_READY.set()
+    if duration > 0 and VIDEO_PREFETCHER is not None:
+        await VIDEO_PREFETCHER.warm_targets(duration)
+
+
+async def parse_timecode(timecode, host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC_PORT):
+    """Convert timecode format (hh:mm:ss, mm:ss or ss, xx%, -1 or +N/-N) to seconds, supporting percentages, -1 for random
+    and offsets from the current position.
+
+    The server normally resolves timecodes and sends plain seconds; the rest is for seeks it could not resolve
+    because it did not know our duration or position yet.
+    """
     # Match hh:mm:ss format
     match = re.match(r'^(\d+):(\d+):(\d+)$', timecode)
     if match:
@@ -105,52 +369,338 @@ def parse_timecode(timecode, host = DEFAULT_VLC_CONNECT_HOST, port = DEFAULT_VLC
     match = re.match(r'^(\d+)%$', timecode)
     if match:
         percentage = int(match.group(1))
-        total_duration = get_video_duration(host, port)
+        total_duration = await get_cached_duration(host, port)
         return int(percentage * 0.01 * total_duration)
 
     # Match -1 for random
     if timecode == "-1":
-        total_duration = get_video_duration(host, port)
+        total_duration = await get_cached_duration(host, port)
         return random.randint(0, total_duration)
 
+    # Match +N/-N for an offset from the current position
+    match = re.match(r'^([+-])(\d+)$', timecode)
+    if match:
+        position = await send_command_to_vlc("get_time", host, port)
+        if not position or not position.isdigit():
+            return None
+        offset = int(match.group(2)) if match.group(1) == "+" else -int(match.group(2))
+        total_duration = await get_cached_duration(host, port)
+        return (int(position) + offset) % total_duration if total_duration else max(0, int(position) + offset)
+
     return None
 
-async def connect_to_server(client_type, auth_token, server_url):
+class ClockSync:
+    """Estimates the offset between the server's monotonic clock and ours.
+
+    Each /time probe gives an NTP-style sample; the sample with the shortest round trip among the
+    recent ones is trusted, since it suffered the least queuing delay.
+    """
+
+    def __init__(self, window=CLOCK_SYNC_SAMPLES):
+        self.samples: deque[tuple[float, float]] = deque(maxlen=window)
+        self.synced = asyncio.Event()
+
+    def add_sample(self, sent_at, server_time, received_at):
+        round_trip = received_at - sent_at
+        offset = server_time - (sent_at + received_at) / 2
+        self.samples.append((round_trip, offset))
+        self.synced.set()
+
+    @property
+    def offset(self):
+        """Server time minus local time, or None before the first sample."""
+        if not self.samples:
+            return None
+        return min(self.samples)[1]
+
+    def to_local(self, server_time):
+        """Convert a server timestamp to our monotonic clock."""
+        return server_time - self.offset
+
+
+async def sync_clock(websocket):
+    """Send /time probes: a quick burst after connecting, then a slow refresh."""
+    probes = 0
+    try:
+        while True:
+            await websocket.send(f"/time {time.monotonic():.6f}")
+            probes += 1
+            await asyncio.sleep(CLOCK_SYNC_BURST_INTERVAL if probes < CLOCK_SYNC_SAMPLES else CLOCK_SYNC_INTERVAL)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+async def playback_state():
+    """Return VLC's position, duration and status as heartbeat fields, "-" where VLC did not answer."""
+    position, duration, playing = await asyncio.gather(
+        send_command_to_vlc("get_time", DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT),
+        send_command_to_vlc("get_length", DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT),
+        send_command_to_vlc("is_playing", DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT),
+    )
+    global VIDEO_DURATION
+    if position is None or not position.isdigit():
+        return "- - down"
+    if duration and duration.isdigit() and int(duration) > 0:
+        VIDEO_DURATION = int(duration)
+    duration = duration if duration and duration.isdigit() else "-"
+    return f"{position} {duration} {'playing' if playing == '1' else 'paused'}"
+
+
+async def send_heartbeats(websocket, client_type):
+    """Tell the server we are alive every HEARTBEAT_INTERVAL seconds, seekers with their playback state."""
+    try:
+        while True:
+            if client_type == "seeker":
+                await websocket.send(f"/heartbeat {await playback_state()}")
+            else:
+                await websocket.send("/heartbeat")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+def tag_reply(reply, command_id):
+    """Append the command ID so the server can match the reply to its command."""
+    return f"{reply} #{command_id}" if command_id else reply
+
+
+async def handle_seek(websocket, timecode, seconds, command_id=None):
+    """Seek VLC to the already parsed timecode of a /seek command and report the result to the server."""
+    print(f"⚠️ SEEK COMMAND RECEIVED - Seeking to {timecode} ({seconds} seconds)")
+    response = await send_command_to_vlc(f"seek {seconds}", DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT)
+    print(f"VLC response: {response}")
+    try:
+        if response is None:
+            # VLC is down or did not answer, so the seek cannot be confirmed
+            await websocket.send(tag_reply("seek_failed", command_id))
+            return
+        # The duration was cached when VLC loaded the video, so the seek is the only VLC round trip
+        await websocket.send(tag_reply(f"seeked {seconds} of {VIDEO_DURATION}", command_id))
+    except websockets.exceptions.ConnectionClosed:
+        print("Connection closed before the seek result could be reported")
+
+
+class SeekMailbox:
+    """Latest-wins mailbox for the /seek commands of one server connection.
+
+    A single worker runs the seeks. One that arrives while an earlier seek still waits for its
+    scheduled instant or for VLC replaces it, and the replaced seek is answered with
+    "superseded #<id>", so a burst of seeks costs one VLC round trip.
+    When the server scheduled the seek for a point in time, VLC is only told to jump at that instant,
+    so all selected seekers move together.
+    """
+
+    def __init__(self, websocket, clock):
+        self.websocket = websocket
+        self.clock = clock
+        self.pending = None
+        self.arrived = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def put(self, timecode, execute_at=None, command_id=None):
+        superseded, self.pending = self.pending, (timecode, execute_at, command_id)
+        self.arrived.set()
+        if superseded is not None:
+            print(f"Seek to {superseded[0]} superseded by seek to {timecode}")
+            if superseded[2]:
+                await self.websocket.send(tag_reply("superseded", superseded[2]))
+
+    def close(self):
+        self.task.cancel()
+
+    async def _run(self):
+        while True:
+            await self.arrived.wait()
+            self.arrived.clear()
+            seek = self.pending
+            timecode, execute_at, command_id = seek
+
+            if VLC_READY is not None and not VLC_READY.is_set():
+                # Seeks that arrive while VLC is still loading run once it is ready, after its initial jump
+                await VLC_READY.wait()
+                if self.arrived.is_set():
+                    continue
+
+            seconds = await parse_timecode(timecode, DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT)
+            if seconds is None:
+                print(f"⚠️ Invalid timecode format: {timecode}")
+                if self.pending is seek:
+                    self.pending = None
+                    if command_id:
+                        await self.websocket.send(tag_reply("seek_failed", command_id))
+                continue
+            # Reads ahead while the seek waits for its instant
+            prefetch(seconds)
+
+            if execute_at is not None and self.clock.offset is None:
+                # Seeks replayed right after reconnecting can beat the first clock sync reply
+                try:
+                    await asyncio.wait_for(self.clock.synced.wait(), CLOCK_SYNC_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+            if execute_at is not None and self.clock.offset is not None:
+                delay = self.clock.to_local(execute_at) - time.monotonic()
+                if delay <= 0:
+                    # The video kept playing since the seek was due, so jump as far past the timecode
+                    seconds += round(-delay)
+                    print(f"Scheduled seek arrived {-delay:.3f}s late, seeking to {seconds} now")
+                elif not self.arrived.is_set():
+                    try:
+                        # Wake up early only to let a newer seek take over
+                        await asyncio.wait_for(self.arrived.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            if self.arrived.is_set():
+                continue
+
+            self.pending = None
+            await handle_seek(self.websocket, timecode, seconds, command_id)
+
+
+async def watch_loop_lag():
+    """Print event loop stalls, and the stack the loop is blocked in while it still is.
+
+    A daemon thread watches the ticks of this task, so a blocking call shows up with its stack
+    even before it returns.
+    """
+    loop_thread = threading.get_ident()
+    last_tick = time.monotonic()
+    stopping = threading.Event()
+
+    def watch():
+        reported_tick = None
+        while not stopping.wait(LOOP_STALL_THRESHOLD / 2):
+            tick = last_tick
+            if tick != reported_tick and time.monotonic() - tick - LOOP_LAG_INTERVAL >= LOOP_STALL_THRESHOLD:
+                reported_tick = tick
+                frame = sys._current_frames().get(loop_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                print(f"⚠️ Event loop blocked for over {LOOP_STALL_THRESHOLD * 1000:.0f}ms in:\n{stack}")
+
+    threading.Thread(target=watch, name="loop-watchdog", daemon=True).start()
+    try:
+        while True:
+            expected = time.monotonic() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            last_tick = time.monotonic()
+            lag = last_tick - expected
+            if lag >= LOOP_STALL_THRESHOLD:
+                print(f"⚠️ Event loop stalled for {lag * 1000:.0f}ms")
+    finally:
+        stopping.set()
+
+
+async def reconnect_later(websocket, delay):
+    """Close the connection after delay, so the reconnect loop moves us to a server that is not restarting."""
+    await asyncio.sleep(delay)
+    print("Moving to another server")
+    await websocket.close(1001, "Server restarting")
+
+
+def reconnect_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter, so a fleet that lost the server does not come back in lockstep.
+
+    A busy server sends a retry-after hint; we wait at least that long, spread over up to twice the hint.
+    """
+    # The exponent is capped well past RECONNECT_MAX_DELAY, so an outage of any length cannot overflow the float
+    delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** min(attempt, 10)))
+    if retry_after:
+        delay = max(delay, random.uniform(retry_after, 2 * retry_after))
+    return delay
+
+
+async def connect_to_server(client_type, auth_token, server_url, session=None, group=""):
+    """Connect, authenticate and handle commands until the connection drops.
+
+    session is a dict kept across reconnects: the server's session token is stored in it and presented
+    on the next connection, so the server can replay the latest command we missed meanwhile. A busy
+    server's retry-after hint is stored there as well.
+    Returns True if the server accepted us before the connection ended, False otherwise.
+    """
+    if session is None:
+        session = {}
+    authenticated = False
+    session.pop("retry_after", None)
+    command_tasks: set[asyncio.Task] = set()
+    # The server clock may have restarted, so every connection starts a fresh estimate
+    clock = ClockSync()
+    seeks = None
     try:
         async with websockets.connect(server_url) as websocket:
             print(f"Connected to WebSocket server as {client_type}")
             host = socket.gethostname()
-            # Send auth token and client type as first message
-            await websocket.send(f"{auth_token}:{client_type}:{host}")
+            # Send auth token and client type as first message, with the session token when reconnecting,
+            # the video's duration once known, so the server can resolve timecodes for us, and our group
+            fields = [auth_token, client_type, host, session.get("token") or "", str(VIDEO_DURATION or ""), group]
+            while len(fields) > 3 and not fields[-1]:
+                fields.pop()
+            handshake = ":".join(fields)
+            try:
+                await websocket.send(handshake)
+            except websockets.exceptions.ConnectionClosed:
+                # A busy server may turn us away before reading it, its /retry hint is still waiting to be read
+                pass
             print("Sent authentication token and client type")
 
+            task = asyncio.create_task(send_heartbeats(websocket, client_type))
+            command_tasks.add(task)
+            task.add_done_callback(command_tasks.discard)
+            if client_type == "seeker":
+                task = asyncio.create_task(sync_clock(websocket))
+                command_tasks.add(task)
+                task.add_done_callback(command_tasks.discard)
+                seeks = SeekMailbox(websocket, clock)
+
             # Receive and print messages from the server
             while True:
                 try:
                     message = await websocket.recv()
+
+                    # Clock sync reply (format: /time <our send time> <server time>)
+                    if message.startswith("/time "):
+                        _, sent_at, server_time = message.split()
+                        clock.add_sample(float(sent_at), float(server_time), time.monotonic())
+                        continue
+
+                    # The server is busy and turns us away (format: /retry <seconds>)
+                    if message.startswith("/retry "):
+                        session["retry_after"] = float(message.split()[1])
+                        print(f"Server busy, asked to retry in {session['retry_after']} seconds")
+                        continue
+
+                    # The server is restarting and gives every client its own moment to move (format: /reconnect <seconds>)
+                    if message.startswith("/reconnect "):
+                        delay = float(message.split()[1])
+                        print(f"Server restarting, reconnecting in {delay} seconds")
+                        task = asyncio.create_task(reconnect_later(websocket, delay))
+                        command_tasks.add(task)
+                        task.add_done_callback(command_tasks.discard)
+                        continue
+
+                    # Session token to present when reconnecting (format: /session <token>)
+                    if message.startswith("/session "):
+                        session["token"] = message.split()[1]
+                        continue
+
                     print(f"Received from server: {message}")
+                    if message.startswith("Authentication successful"):
+                        authenticated = True
+
+                    # Broadcast commands end with an ID to echo back in the reply (format: <command> #<id>)
+                    message, _, command_id = message.partition(" #")
 
                     # Process specific commands
                     if message.startswith("/seek ") and client_type == "seeker":
-                        # Extract timecode from message (format: /seek hh:mm:ss or /seek mm:ss or /seek ss or /seek xx% or /seek -1)
-                        timecode = message[6:].strip()
-                        seconds = parse_timecode(timecode)
-                        total_duration = get_video_duration(DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT)
-
-                        if seconds is not None:
-                            print(
-                                f"⚠️ SEEK COMMAND RECEIVED - Seeking to {timecode} ({seconds} seconds)")
-                            response = send_command_to_vlc(
-                                f"seek {seconds}", DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT)
-                            await websocket.send(f"seeked {seconds} of {total_duration}")
-                            print(f"VLC response: {response}")
-                        else:
-                            print(f"⚠️ Invalid timecode format: {timecode}")
-                            # Could send error back to server here
+                        # Extract timecode from message (format: /seek hh:mm:ss or /seek mm:ss or /seek ss or /seek xx% or /seek -1),
+                        # optionally followed by the server time to execute it at (format: @<server time>)
+                        timecode, _, execute_at = message[6:].strip().partition(" @")
+                        # VLC is driven by the mailbox in the background so the receive loop keeps running
+                        await seeks.put(timecode, float(execute_at) if execute_at else None, command_id)
 
                     elif message == "/switch" and client_type == "switcher":
                         print("🔄 SWITCH COMMAND RECEIVED - ACTIVATING SWITCHER MODE")
                         # Add switcher-specific logic here
+                        await websocket.send(tag_reply("switched", command_id))
 
                 except websockets.exceptions.ConnectionClosed:
                     print("Connection closed by server")
@@ -161,15 +711,18 @@ async def connect_to_server(client_type, auth_token, server_url):
 
     except Exception as e:
         print(f"Failed to connect to server: {e}")
-        # Wait before reconnecting
-        await asyncio.sleep(10)
         return False
+    finally:
+        for task in command_tasks:
+            task.cancel()
+        if seeks is not None:
+            seeks.close()
 
-    return True
+    return authenticated
 
 
 async def main():
-    global DEFAULT_VLC_ADVERTISE_HOST, DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT, VLC_PROCESS
+    global DEFAULT_VLC_ADVERTISE_HOST, DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT, VLC_PROCESS, VLC_READY, VIDEO_PREFETCHER
 
     parser = argparse.ArgumentParser(description='WebSocket Client')
     parser.add_argument('--type', choices=['seeker', 'switcher'], default=DEFAULT_CLIENT_TYPE,
@@ -184,12 +737,15 @@ async def main():
                         help='VLC port number (for seeker client)')
     parser.add_argument('--video', default=DEFAULT_VIDEO_PATH,
                         help='Path to video file (for seeker client)')
+    parser.add_argument('--group', default=DEFAULT_GROUP,
+                        help='Group to join, commands can target a single group (default: the server\'s default group)')
 
     args = parser.parse_args()
     client_type = args.type
     auth_token = args.token
     server_url = args.server
     video_path = args.video
+    group = args.group
 
     DEFAULT_VLC_ADVERTISE_HOST = args.vlc_host
     DEFAULT_VLC_PORT = args.vlc_port
@@ -197,34 +753,37 @@ async def main():
     print(f"Starting client as {client_type}")
     print(f"Connecting to server at {server_url}")
 
+    lag_watch = asyncio.create_task(watch_loop_lag())
+
     # Start VLC if this is a seeker client
+    vlc_setup = None
     if client_type == "seeker":
         print(f"VLC connection: {DEFAULT_VLC_ADVERTISE_HOST}:{DEFAULT_VLC_PORT}")
         print(f"Video path: {video_path}")
 
-        # Start VLC process
+        # Start VLC process and connect to the server while it loads the video
         VLC_PROCESS = start_vlc(video_path, DEFAULT_VLC_ADVERTISE_HOST, DEFAULT_VLC_PORT)
-
-        # Wait for VLC to load video
-        time.sleep(2)
-
-        # Get video duration
-        duration = get_video_duration(DEFAULT_VLC_CONNECT_HOST, DEFAULT_VLC_PORT)
-        if duration > 0:
-            # Seek to a random position between 0 and 80% of the video
-            random_position = random.randint(0, int(duration * 0.8))
-            print(f"Seeking to random position: {random_position} seconds")
-            send_command_to_vlc(
-                f"seek {random_position}", DEFAULT_VLC_ADVERTISE_HOST, DEFAULT_VLC_PORT)
+        VLC_READY = asyncio.Event()
+        VIDEO_PREFETCHER = VideoPrefetcher(video_path)
+        vlc_setup = asyncio.create_task(prepare_vlc(VLC_PROCESS))
 
     try:
         # Reconnection loop
+        session = {}
+        attempt = 0
         while True:
-            connected = await connect_to_server(client_type, auth_token, server_url)
-            if not connected:
-                print("Connection failed. Reconnecting in 10 seconds...")
-                await asyncio.sleep(10)
+            connected = await connect_to_server(client_type, auth_token, server_url, session, group)
+            # A connection that worked resets the backoff, so a server blip costs well under a second
+            attempt = 0 if connected else attempt + 1
+            delay = reconnect_delay(attempt, session.get("retry_after"))
+            print(f"Reconnecting in {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
     finally:
+        lag_watch.cancel()
+        if vlc_setup is not None:
+            vlc_setup.cancel()
+        if VIDEO_PREFETCHER is not None:
+            VIDEO_PREFETCHER.close()
         # Clean up VLC process when the client exits
         if VLC_PROCESS:
             try:
@@ -0,0 +1,383 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""Coordination between server replicas over a backplane.
+
+Every replica publishes a roster of its connections and competes for a leader lease. The leader owns
+the Telegram bot: it splits each command across replicas (for seeks, a uniformly random n/2+1 of all
+seekers in the cluster), publishes it, and collects the confirmation report of every replica involved.
+Each replica fans out only to its own connections.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from bisect import bisect_right
+from typing import Awaitable, Callable, Dict, List, Optional
+from backplane import Backplane
+from log import log_event
+
+logger = logging.getLogger("muppet.cluster")
+
+# Cluster configuration from environment variables with fallbacks
+# Unique name of this replica, the pod name is a good choice
+REPLICA_ID = os.environ.get("REPLICA_ID") or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+# Seconds between roster updates; a replica is forgotten after three missed updates
+ROSTER_INTERVAL = float(os.environ.get("ROSTER_INTERVAL", "2"))
+# Seconds the leader lease lasts without renewal
+LEADER_LEASE_TTL = float(os.environ.get("LEADER_LEASE_TTL", "10"))
+
+LEADER_KEY = "leader"
+ROSTER_PREFIX = "replica:"
+SESSION_PREFIX = "session:"
+# Extra seconds the leader waits for replica reports on top of the replicas' own ack timeout
+REPORT_GRACE = 2.0
+
+
+def allocate(counts: Dict[str, int], k: int) -> Dict[str, int]:
+    """Split a uniformly random sample of k out of all counted clients into a per-replica quota."""
+    replicas = [replica for replica, count in counts.items() if count > 0]
+    boundaries = list(itertools.accumulate(counts[replica] for replica in replicas))
+    population = boundaries[-1] if boundaries else 0
+    quota = dict.fromkeys(replicas, 0)
+    for index in random.sample(range(population), min(k, population)):
+        quota[replicas[bisect_right(boundaries, index)]] += 1
+    return {replica: count for replica, count in quota.items() if count}
+
+
+class ClusterCommand:
+    """A command dispatched by the leader, waiting for the reports of the replicas that run it."""
+
+    def __init__(self, command_id: int, name: str, replicas):
+        self.id = command_id
+        self.name = name
+        self.replicas = set(replicas)
+        self.reports: Dict[str, dict] = {}
+        self.done = asyncio.Event()
+        if not self.replicas:
+            self.done.set()
+
+    def add_report(self, replica: str, report: dict):
+        if replica in self.replicas:
+            self.reports[replica] = report
+            if len(self.reports) >= len(self.replicas):
+                self.done.set()
+
+    async def wait(self, timeout: float) -> "ClusterCommand":
+        try:
+            await asyncio.wait_for(self.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self
+
+    def as_dict(self) -> dict:
+        """The confirmations reported so far, summed over the replicas."""
+        return {
+            "id": self.id,
+            "command": self.name,
+            "replicas": len(self.replicas),
+            "reported": len(self.reports),
+            "expected": sum(report["expected"] for report in self.reports.values()),
+            "confirmed": sum(report["confirmed"] for report in self.reports.values()),
+            "superseded": sum(report.get("superseded", 0) for report in self.reports.values()),
+            "failed": sum(report.get("failed", 0) for report in self.reports.values()),
+            "slowest": max((report["slowest"] for report in self.reports.values() if report.get("slowest") is not None), default=None),
+            "done": self.done.is_set(),
+        }
+
+    def summary(self) -> str:
+        totals = self.as_dict()
+        text = f"{self.name} #{self.id}: confirmed by {totals['confirmed']} of {totals['expected']} clients"
+        if len(self.replicas) > 1:
+            text += f" on {len(self.reports)} of {len(self.replicas)} replicas"
+        if totals["slowest"] is not None:
+            text += f", slowest after {totals['slowest'] * 1000:.0f}ms"
+        if totals["superseded"]:
+            text += f", superseded on {totals['superseded']}"
+        if totals["failed"]:
+            text += f", failed on {totals['failed']}"
+        return text
+
+
+class Cluster:
+    """This replica's view of the cluster.
+
+    roster() describes the local connections ({"counts": {type: n}, "hosts": {type: [sorted hosts]},
+    "groups": {group: {type: n}}}),
+    execute(message) runs a published command locally and returns its confirmation report,
+    on_leadership(bool) is awaited whenever this replica gains or loses the leader lease,
+    on_command(message), if given, sees every published command, including those for other replicas, and
+    snapshot(), if given, lists the local clients for list_clients() on any replica.
+    """
+
+    def __init__(self, backplane: Backplane, roster: Callable[[], dict],
+                 execute: Callable[[dict], Awaitable[dict]],
+                 on_leadership: Callable[[bool], Awaitable[None]],
+                 replica_id: str = REPLICA_ID, ack_timeout: float = 5.0,
+                 on_command: Optional[Callable[[dict], None]] = None,
+                 snapshot: Optional[Callable[[], List[dict]]] = None):
+        self.backplane = backplane
+        self.roster = roster
+        self.execute = execute
+        self.on_leadership = on_leadership
+        self.on_command = on_command
+        self.snapshot = snapshot
+        self.replica_id = replica_id
+        self.ack_timeout = ack_timeout
+        self.leader = False
+        # Cleared by step_down(), after which this replica never takes the lease again
+        self.candidate = True
+        self.pending: Dict[int, ClusterCommand] = {}
+        # Any replica dispatches commands (webhook updates, the admin API), so each one counts from a random
+        # start; replicas reporting to each other must never see two commands with the same ID
+        self.command_ids = itertools.count(random.randrange(1, 2 ** 40))
+        self.tasks: List[asyncio.Task] = []
+        self.running: set = set()
+
+    async def start(self):
+        await self.backplane.start()
+        self.backplane.subscribe(self._on_message)
+        await self._publish_roster()
+        await self._elect()
+        self.tasks.append(asyncio.create_task(self._roster_loop()))
+        self.tasks.append(asyncio.create_task(self._lease_loop()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        try:
+            await self.backplane.delete(ROSTER_PREFIX + self.replica_id)
+            if self.leader:
+                await self.backplane.release(LEADER_KEY, self.replica_id)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        if self.leader:
+            self.leader = False
+            await self.on_leadership(False)
+        await self.backplane.stop()
+
+    async def _publish_roster(self):
+        try:
+            await self.backplane.set(ROSTER_PREFIX + self.replica_id, self.roster(), ttl=ROSTER_INTERVAL * 3)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            log_event(logger, "roster_failed", "Could not publish roster: %s", e, level=logging.WARNING, sampled=True)
+
+    async def _roster_loop(self):
+        while True:
+            await asyncio.sleep(ROSTER_INTERVAL)
+            await self._publish_roster()
+
+    async def _elect(self):
+        if not self.candidate:
+            return
+        try:
+            leader = await self.backplane.acquire(LEADER_KEY, self.replica_id, LEADER_LEASE_TTL)
+        except (ConnectionError, asyncio.TimeoutError):
+            # Without the backplane we cannot prove we still hold the lease
+            leader = False
+        if leader != self.leader:
+            self.leader = leader
+            log_event(logger, "leadership_changed", "Replica %s %s the leader lease", self.replica_id,
+                      "acquired" if leader else "lost", replica=self.replica_id, leader=leader)
+            try:
+                await self.on_leadership(leader)
+            except Exception as e:
+                log_event(logger, "leadership_callback_failed", "Leadership change on replica %s failed: %s", self.replica_id, e,
+                          level=logging.ERROR, replica=self.replica_id, leader=leader)
+                if leader:
+                    # E.g. Telegram was unreachable; give up the lease so this or another replica tries again
+                    self.leader = False
+                    try:
+                        await self.backplane.release(LEADER_KEY, self.replica_id)
+                    except (ConnectionError, asyncio.TimeoutError):
+                        pass
+
+    async def _lease_loop(self):
+        while True:
+            await asyncio.sleep(LEADER_LEASE_TTL / 3)
+            try:
+                await self._elect()
+            except Exception as e:
+                # The lease must keep being renewed or contested whatever went wrong this round
+                log_event(logger, "lease_loop_error", "Leader election failed: %s", e, level=logging.ERROR)
+
+    async def step_down(self):
+        """Stop competing for the leader lease and release it if we hold it, so another replica takes
+        over within one lease renewal round instead of waiting for the lease to expire."""
+        self.candidate = False
+        if not self.leader:
+            return
+        try:
+            await self.backplane.release(LEADER_KEY, self.replica_id)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        self.leader = False
+        log_event(logger, "leadership_changed", "Replica %s released the leader lease", self.replica_id,
+                  replica=self.replica_id, leader=False)
+        await self.on_leadership(False)
+
+    async def members(self) -> Dict[str, dict]:
+        """Return the roster of every live replica, keyed by replica ID."""
+        try:
+            entries = await self.backplane.scan(ROSTER_PREFIX)
+        except (ConnectionError, asyncio.TimeoutError):
+            entries = {}
+        members = {key[len(ROSTER_PREFIX):]: roster for key, roster in entries.items()}
+        # Our own roster is always current, even if the backplane is unreachable
+        members[self.replica_id] = self.roster()
+        return members
+
+    async def count(self, client_type: str, group: Optional[str] = None) -> int:
+        return sum(group_count(roster, client_type, group) for roster in (await self.members()).values())
+
+    async def dispatch(self, message: str, client_type: str, sample: bool = False,
+                       due_at: Optional[float] = None, group: Optional[str] = None) -> ClusterCommand:
+        """Publish a command for all clients of a type, or for a random n/2+1 of them with sample,
+        in one group or, without group, in all of them.
+
+        due_at is a wall clock time (time.time()), since replicas do not share a monotonic clock.
+        Raises ConnectionError if the command could not be published.
+        """
+        counts = {replica: group_count(roster, client_type, group) for replica, roster in (await self.members()).items()}
+        if sample:
+            total = sum(counts.values())
+            quota = allocate(counts, max(1, (total // 2) + 1)) if total else {}
+        else:
+            # Rosters can be ROSTER_INTERVAL old, so every live replica gets the command and fans it out to
+            # whoever it has by then, including clients that connected since its last roster
+            quota = dict.fromkeys(counts)
+
+        command = ClusterCommand(next(self.command_ids), message.split()[0], quota)
+        # Tracked before publishing so no report can arrive ahead of it
+        self.pending[command.id] = command
+        log_event(logger, "cluster_dispatch", "Dispatching %s #%d to %d replicas", message, command.id, len(quota),
+                  command=message, command_id=command.id, quota=quota, sample=sample, group=group)
+        try:
+            await self.backplane.publish({
+                "type": "command",
+                "leader": self.replica_id,
+                "id": command.id,
+                "message": message,
+                "client_type": client_type,
+                "group": group,
+                # None means every client of the type on that replica
+                "quota": quota if sample else dict.fromkeys(quota),
+                "due_at": due_at,
+            })
+        except ConnectionError as e:
+            self.pending.pop(command.id, None)
+            log_event(logger, "cluster_dispatch_failed", "Could not publish %s #%d: %s", message, command.id, e,
+                      level=logging.ERROR, command=message, command_id=command.id)
+            raise
+        return command
+
+    async def wait(self, command: ClusterCommand) -> ClusterCommand:
+        """Wait for every involved replica to report, then stop tracking the command."""
+        try:
+            return await command.wait(self.ack_timeout + REPORT_GRACE)
+        finally:
+            self.pending.pop(command.id, None)
+
+    async def list_clients(self) -> Dict[str, List[dict]]:
+        """Ask every live replica for its snapshot() and return them keyed by replica ID.
+
+        Replicas that do not answer within REPORT_GRACE seconds are left out.
+        """
+        others = [replica for replica in await self.members() if replica != self.replica_id]
+        # Answers come back as reports, like the confirmations of a command
+        request = ClusterCommand(next(self.command_ids), "clients", others)
+        self.pending[request.id] = request
+        try:
+            if others:
+                await self.backplane.publish({"type": "list_clients", "leader": self.replica_id, "id": request.id})
+                await request.wait(REPORT_GRACE)
+        except ConnectionError as e:
+            log_event(logger, "list_clients_failed", "Could not ask replicas for their clients: %s", e,
+                      level=logging.WARNING, sampled=True)
+        finally:
+            self.pending.pop(request.id, None)
+        missing = set(others) - set(request.reports)
+        if missing:
+            log_event(logger, "list_clients_incomplete", "Replicas %s did not list their clients in time", ", ".join(sorted(missing)),
+                      level=logging.WARNING, sampled=True, missing=sorted(missing))
+        listings = {replica: report["clients"] for replica, report in request.reports.items()}
+        listings[self.replica_id] = self.snapshot() if self.snapshot is not None else []
+        return listings
+
+    async def park_session(self, token: str, state: dict, ttl: float):
+        """Remember a disconnected client session for ttl seconds, so any replica can resume it."""
+        try:
+            await self.backplane.set(SESSION_PREFIX + token, state, ttl)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            log_event(logger, "session_park_failed", "Could not park session: %s", e, level=logging.WARNING, sampled=True)
+
+    async def claim_session(self, token: str) -> Optional[dict]:
+        """Return and forget a parked session, or None if it is unknown or expired."""
+        try:
+            state = await self.backplane.get(SESSION_PREFIX + token)
+            if state is not None:
+                await self.backplane.delete(SESSION_PREFIX + token)
+            return state
+        except (ConnectionError, asyncio.TimeoutError):
+            return None
+
+    async def _on_message(self, message: dict):
+        if message.get("type") == "command":
+            if self.on_command is not None:
+                self.on_command(message)
+            if self.replica_id in message["quota"]:
+                # Run it in the background so the backplane keeps delivering messages meanwhile
+                task = asyncio.create_task(self._run(message))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+        elif message.get("type") == "list_clients" and message["leader"] != self.replica_id and self.snapshot is not None:
+            try:
+                await self.backplane.publish({
+                    "type": "report",
+                    "leader": message["leader"],
+                    "id": message["id"],
+                    "replica": self.replica_id,
+                    "report": {"clients": self.snapshot()},
+                })
+            except ConnectionError as e:
+                log_event(logger, "report_failed", "Could not list clients for %s: %s", message["leader"], e, level=logging.WARNING)
+        elif message.get("type") == "report" and message.get("leader") == self.replica_id:
+            command = self.pending.get(message["id"])
+            if command is not None:
+                command.add_report(message["replica"], message["report"])
+
+    async def _run(self, message: dict):
+        report = await self.execute(message)
+        try:
+            await self.backplane.publish({
+                "type": "report",
+                "leader": message["leader"],
+                "id": message["id"],
+                "replica": self.replica_id,
+                "report": report,
+            })
+        except ConnectionError as e:
+            log_event(logger, "report_failed", "Could not report command #%s: %s", message["id"], e, level=logging.WARNING)
+
+
+def group_count(roster: dict, client_type: str, group: Optional[str] = None) -> int:
+    """Clients of a type in a replica's roster, in one group or in all of them."""
+    if group is None:
+        return roster["counts"].get(client_type, 0)
+    return roster.get("groups", {}).get(group, {}).get(client_type, 0)
+
+
+def merge_hosts(members: Dict[str, dict], client_type: str) -> List[str]:
+    """Sorted hosts of all clients of a type across the given rosters."""
+    return list(heapq.merge(*(roster["hosts"].get(client_type, []) for roster in members.values())))
+
+
+def local_due_at(due_at: Optional[float]) -> Optional[float]:
+    """Convert a wall clock deadline from the leader to this replica's monotonic clock."""
+    if due_at is None:
+        return None
+    return time.monotonic() + (due_at - time.time())
@@ -0,0 +1,159 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+import websockets
+from log import log_event
+
+logger = logging.getLogger("muppet.fanout")
+
+# Fan-out configuration from environment variables with fallbacks
+# Frames that may wait in a single client's outbound queue before it counts as a slow consumer
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("OUTBOUND_QUEUE_SIZE", "16"))
+# Seconds a single frame may take to be written before the client is evicted
+SEND_TIMEOUT = float(os.environ.get("SEND_TIMEOUT", "5"))
+
+
+class ClientChannel:
+    """Outbound side of a client connection: a bounded frame queue drained by its own writer task.
+
+    The queue doubles as a latest-wins mailbox: a frame offered with a key replaces a frame with the
+    same key that is still waiting to be written, so a client that falls behind only gets the newest one.
+    """
+
+    def __init__(self, websocket: websockets.ServerProtocol,
+                 maxsize: int = OUTBOUND_QUEUE_SIZE, send_timeout: float = SEND_TIMEOUT):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.maxsize = maxsize
+        # Entries are [frame, done future, key], kept mutable so a newer frame can take an entry's place
+        self.queue: Deque[list] = deque()
+        self.latest: Dict[str, list] = {}
+        self.ready = asyncio.Event()
+        self.slow = False
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+
+    def offer(self, frame: bytes, key: Optional[str] = None) -> Optional[asyncio.Future]:
+        """Queue an encoded text frame without waiting.
+
+        Returns a future that resolves to True once the frame is written, False if it never will be,
+        or None if a newer frame with the same key replaced it first. Returns None instead of a future
+        if the channel is closed or its queue is full.
+        """
+        if self.closed:
+            return None
+        done = asyncio.get_running_loop().create_future()
+        entry = self.latest.get(key) if key is not None else None
+        if entry is not None:
+            _resolve(entry[1], None)
+            entry[0], entry[1] = frame, done
+            return done
+        if len(self.queue) >= self.maxsize:
+            self.slow = True
+            return None
+        entry = [frame, done, key]
+        self.queue.append(entry)
+        if key is not None:
+            self.latest[key] = entry
+        self.ready.set()
+        return done
+
+    async def _next(self) -> list:
+        while not self.queue:
+            self.ready.clear()
+            await self.ready.wait()
+        entry = self.queue.popleft()
+        if entry[2] is not None:
+            del self.latest[entry[2]]
+        return entry
+
+    async def _writer(self):
+        try:
+            while True:
+                frame, done, _ = await self._next()
+                try:
+                    await asyncio.wait_for(self.websocket.send(frame, text=True), self.send_timeout)
+                except asyncio.TimeoutError:
+                    _resolve(done, False)
+                    self.evict("send deadline exceeded")
+                    return
+                except websockets.exceptions.ConnectionClosed:
+                    _resolve(done, False)
+                    self.closed = True
+                    return
+                _resolve(done, True)
+        finally:
+            self._fail_pending()
+
+    def _fail_pending(self):
+        while self.queue:
+            _, done, _ = self.queue.popleft()
+            _resolve(done, False)
+        self.latest.clear()
+
+    def evict(self, reason: str):
+        """Drop the connection without waiting for a closing handshake the peer may never answer."""
+        if self.closed:
+            return
+        self.slow = True
+        self.closed = True
+        log_event(logger, "client_evicted", "Evicting client %s: %s", self.websocket.remote_address, reason,
+                  level=logging.WARNING, reason=reason)
+        transport = getattr(self.websocket, "transport", None)
+        if transport is not None:
+            transport.abort()
+
+    def close(self):
+        """Stop the writer task; queued frames are reported as undelivered."""
+        self.closed = True
+        self.task.cancel()
+        self._fail_pending()
+
+
+def _resolve(future: asyncio.Future, result: Optional[bool]):
+    if not future.done():
+        future.set_result(result)
+
+
+async def fan_out(channels: Iterable[ClientChannel], message: str, timeout: float = SEND_TIMEOUT,
+                  key: Optional[str] = None) -> Tuple[int, List[ClientChannel], List[ClientChannel]]:
+    """Send one message to many clients at once.
+
+    The message is encoded a single time and offered to every channel's queue, then the call waits
+    (at most `timeout` seconds) for the writers to finish. Clients whose queue is full are evicted;
+    clients that miss the deadline are flagged slow and left to their writer's own send deadline.
+    With a key, the message is latest-wins: a later message with the same key replaces it in queues
+    where it is still waiting.
+    Returns the number of confirmed deliveries, the channels that did not confirm and the channels
+    where a later message superseded this one.
+    """
+    frame = message.encode("utf-8")
+    pending = {}
+    failed: List[ClientChannel] = []
+    superseded: List[ClientChannel] = []
+    for channel in channels:
+        done = channel.offer(frame, key)
+        if done is None:
+            if not channel.closed:
+                channel.evict("outbound queue full")
+            failed.append(channel)
+        else:
+            pending[done] = channel
+
+    if pending:
+        await asyncio.wait(pending, timeout=timeout)
+
+    delivered = 0
+    for done, channel in pending.items():
+        if done.done() and done.result():
+            delivered += 1
+        elif done.done() and done.result() is None:
+            superseded.append(channel)
+        else:
+            channel.slow = True
+            failed.append(channel)
+    return delivered, failed, superseded
@@ -0,0 +1,77 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import os
+import re
+import time
+from typing import Optional
+
+# Heartbeat configuration from environment variables with fallbacks
+# Seconds a client that sends heartbeats may stay silent before it is considered dead
+HEARTBEAT_TIMEOUT = float(os.environ.get("HEARTBEAT_TIMEOUT", "15"))
+
+# Playback states reported by seekers
+PLAYING = "playing"
+PAUSED = "paused"
+VLC_DOWN = "down"
+STATUSES = (PLAYING, PAUSED, VLC_DOWN)
+
+_SEEKED = re.compile(r"^seeked (\d+) of (\d+)")
+
+
+class PlaybackState:
+    """What a seeker last reported about its VLC: position and duration in seconds, and a status."""
+
+    __slots__ = ("position", "duration", "status", "reported_at")
+
+    def __init__(self, position: Optional[float], duration: Optional[float], status: str,
+                 reported_at: Optional[float] = None):
+        self.position = position
+        self.duration = duration
+        self.status = status
+        self.reported_at = time.monotonic() if reported_at is None else reported_at
+
+    def current_position(self, now: Optional[float] = None) -> Optional[float]:
+        """Position extrapolated to now, wrapping around since VLC plays the video in a loop."""
+        if self.position is None:
+            return None
+        position = self.position
+        if self.status == PLAYING:
+            position += (time.monotonic() if now is None else now) - self.reported_at
+        if self.duration:
+            position %= self.duration
+        return position
+
+    def as_dict(self) -> dict:
+        return {
+            "position": self.current_position(),
+            "duration": self.duration,
+            "status": self.status,
+            "age": time.monotonic() - self.reported_at,
+        }
+
+
+def _number(field: str) -> Optional[float]:
+    return None if field == "-" else float(field)
+
+
+def parse_heartbeat(message: str) -> Optional[PlaybackState]:
+    """Parse a heartbeat (format: "/heartbeat [<position> <duration> <status>]").
+
+    Switchers send a bare "/heartbeat", which carries no playback state.
+    """
+    fields = message.split()[1:]
+    if len(fields) != 3 or fields[2] not in STATUSES:
+        return None
+    try:
+        return PlaybackState(_number(fields[0]), _number(fields[1]), fields[2])
+    except ValueError:
+        return None
+
+
+def parse_seeked(message: str, status: str = PLAYING) -> Optional[PlaybackState]:
+    """A seek confirmation (format: "seeked <position> of <duration> #<id>") also tells where the seeker is now."""
+    match = _SEEKED.match(message)
+    if match is None:
+        return None
+    position, duration = map(int, match.groups())
+    return PlaybackState(position, duration or None, status)
@@ -66,6 +66,8 @@ SERVER_URL=${SERVER_URL:-"ws://localhost:8765"}
 read -p "Enter authentication token (or press Enter for default 'secret_token_123'): " AUTH_TOKEN
 AUTH_TOKEN=${AUTH_TOKEN:-"secret_token_123"}
 
+read -p "Enter group of this installation (or press Enter for the default group): " GROUP
+
 echo "Creating a client-specific config file..."
 if [ "$CLIENT_TYPE" = "seeker" ]; then
     # Prompt for video path for seeker clients
@@ -79,6 +81,8 @@ CLIENT_TYPE = "$CLIENT_TYPE"
 AUTH_TOKEN = "$AUTH_TOKEN"
 # WebSocket server URL
 SERVER_URL = "$SERVER_URL"
+# Group this client joins, commands can target a single group
+GROUP = "$GROUP"
 # VLC connection settings
 VLC_ADVERTISE_HOST = "localhost"
 VLC_CONNECT_HOST = "localhost"
@@ -95,6 +99,8 @@ CLIENT_TYPE = "$CLIENT_TYPE"
 AUTH_TOKEN = "$AUTH_TOKEN"
 # WebSocket server URL
 SERVER_URL = "$SERVER_URL"
+# Group this client joins, commands can target a single group
+GROUP = "$GROUP"
 EOF
 fi
 
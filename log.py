@@ -0,0 +1,134 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional
+
+# Logging configuration from environment variables with fallbacks
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" for one structured event per line, "text" for plain messages while developing
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# How many sampled events (such as per-message receipts) of one kind may be written per second
+LOG_SAMPLED_PER_SECOND = float(os.environ.get("LOG_SAMPLED_PER_SECOND", "5"))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event name, message and the event's fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = (getattr(record, "fields", None) or {}).get("suppressed")
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """Rate-limits records logged with sampled=True, per event name, with a token bucket.
+
+    Other records always pass. The number of records dropped since the last one that passed is
+    reported in that record's "suppressed" field.
+    """
+
+    def __init__(self, per_second: float = LOG_SAMPLED_PER_SECOND):
+        super().__init__()
+        self.per_second = per_second
+        self.tokens: Dict[str, float] = {}
+        self.updated: Dict[str, float] = {}
+        self.suppressed: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        event = getattr(record, "event", None) or record.name
+        now = time.monotonic()
+        tokens = min(self.per_second, self.tokens.get(event, self.per_second)
+                     + (now - self.updated.get(event, now)) * self.per_second)
+        self.updated[event] = now
+        if tokens < 1:
+            self.tokens[event] = tokens
+            self.suppressed[event] = self.suppressed.get(event, 0) + 1
+            return False
+        self.tokens[event] = tokens - 1
+        suppressed = self.suppressed.pop(event, 0)
+        if suppressed:
+            record.fields = {**(getattr(record, "fields", None) or {}), "suppressed": suppressed}
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves formatting to the listener thread instead of the event loop."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The record is only read by the listener; fields are plain values, so no copy is needed
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Route all logging through a queue to a background thread that formats and writes to stdout."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter("%(asctime)s %(levelname)s %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # httpx logs every Telegram API request, including each long poll, and websockets every connection
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(logger: logging.Logger, event: str, message: str, *args,
+              level: int = logging.INFO, sampled: bool = False, **fields):
+    """Log a structured event.
+
+    `message` is a %-style format string expanded with `args` only when the record is written.
+    `fields` become top-level keys of the JSON line. Pass sampled=True for high-volume events that
+    may be rate-limited; everything else is always kept.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={"event": event, "fields": fields, "sampled": sampled})
+
@@ -0,0 +1,146 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+from log import log_event
+from metrics import Counter, Histogram, LatencyHistogram
+
+logger = logging.getLogger("muppet.loopwatch")
+
+# Loop watchdog configuration from environment variables with fallbacks
+# Seconds between ticks of the lag probe
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.1"))
+# Lag in seconds past which the loop counts as stalled and the blocking stack is logged
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "0.25"))
+# Seconds of CPU time between stack samples while the profiler is on
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+
+class LoopWatchdog:
+    """Measures event loop lag and catches what blocks the loop.
+
+    A task on the loop wakes up every `interval`; how late it wakes up is the lag. A daemon thread
+    checks that the task keeps ticking, and once the loop has been stuck for `threshold` it logs the
+    stack the loop thread is stuck in, while it still is.
+
+    The sampling profiler can be switched on and off at runtime. It samples on a SIGPROF timer
+    rather than from the thread, which hardly gets the GIL while the loop is busy with many short
+    callbacks, exactly when profiling matters. So the loop has to run in the main thread, and only
+    time spent on the CPU is sampled. dump() returns the samples as folded stacks, the input format
+    of flamegraph tools.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD,
+                 profile_interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.threshold = threshold
+        self.profile_interval = profile_interval
+        self.lag = LatencyHistogram()
+        self.max_lag = 0.0
+        self.last_stall: Optional[float] = None
+        self.stalls = Counter("muppet_loop_stalls_total", "Event loop lags past the stall threshold")
+        Histogram("muppet_loop_lag_seconds", "How late the event loop ran a timer", self.lag)
+        self.profiling = False
+        self.samples = 0
+        self.profile: Dict[str, int] = {}
+        self._last_tick = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stopping = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start watching the running loop; call from the loop's thread."""
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = asyncio.create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self.profiling:
+            self.set_profiling(False)
+        self._stopping.set()
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._last_tick = now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stalls.inc()
+                self.last_stall = now
+                log_event(logger, "loop_stall", "Event loop stalled for %.0fms", lag * 1000,
+                          level=logging.WARNING, lag=lag)
+
+    def _watch(self):
+        reported_tick = None
+        while not self._stopping.wait(self.threshold / 2):
+            tick = self._last_tick
+            if tick != reported_tick and time.monotonic() - tick - self.interval >= self.threshold:
+                # Report each stall once, with the stack it is stuck in right now
+                reported_tick = tick
+                frame = sys._current_frames().get(self._loop_thread)  # pylint: disable=protected-access
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                log_event(logger, "loop_blocked", "Event loop blocked for over %.0fms in:\n%s", self.threshold * 1000, stack,
+                          level=logging.WARNING, stack=stack)
+
+    def _sample(self, signum, frame):
+        # Runs in the main thread between two bytecodes, like any signal handler
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if names:
+            folded = ";".join(reversed(names))
+            self.profile[folded] = self.profile.get(folded, 0) + 1
+            self.samples += 1
+
+    def set_profiling(self, enabled: bool):
+        """Switch the profiler on, starting from no samples, or off, keeping the samples for dump().
+
+        Call from the main thread; raises RuntimeError where SIGPROF timers are not available.
+        """
+        if not hasattr(signal, "setitimer"):
+            raise RuntimeError("Profiling needs SIGPROF timers, which this platform lacks")
+        if enabled and not self.profiling:
+            self.profile = {}
+            self.samples = 0
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.profile_interval, self.profile_interval)
+        elif not enabled and self.profiling:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            # A signal still in flight must not hit the default action, which kills the process
+            signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.profiling = enabled
+        log_event(logger, "profiling_toggled", "Profiling %s", "started" if enabled else "stopped", profiling=enabled)
+
+    def dump(self) -> str:
+        """The profile as folded stacks ("outer;inner count" per line), most sampled first."""
+        profile = sorted(self.profile.items(), key=lambda item: item[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in profile)
+
+    def stats(self) -> dict:
+        p99 = self.lag.percentile(0.99)
+        return {
+            "lag_p50": self.lag.percentile(0.5),
+            # Bucket bounds can overshoot, the real lag never exceeded the maximum
+            "lag_p99": min(p99, self.max_lag) if p99 is not None else None,
+            "lag_max": self.max_lag,
+            "stalls": self.stalls.value,
+            "last_stall_ago": time.monotonic() - self.last_stall if self.last_stall is not None else None,
+            "profiling": self.profiling,
+        }
@@ -0,0 +1,142 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, from a fast LAN round trip up to a VLC that barely answers
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; observing a value is a bisect and two additions."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One extra slot for values above the last bound
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile (0..1), None without observations."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self) -> str:
+        if not self.count:
+            return "no samples"
+        return f"p50 ≤ {_format_seconds(self.percentile(0.5))}, p95 ≤ {_format_seconds(self.percentile(0.95))}, " \
+            f"avg {_format_seconds(self.sum / self.count)} over {self.count}"
+
+
+def _format_seconds(value: float) -> str:
+    if value == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]:g}s"
+    return f"{value * 1000:.0f}ms"
+
+
+class Metric:
+    """Base for metrics exposed on /metrics. Every instance registers itself in REGISTRY."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, **labels: str):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        """Yield (name suffix, extra labels, value) for the exposition."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, **labels: str):
+        super().__init__(name, help_text, **labels)
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def samples(self):
+        yield "", {}, self.value
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or computed by a callback when scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None, **labels: str):
+        super().__init__(name, help_text, **labels)
+        self.value = 0
+        self.callback = callback
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self):
+        yield "", {}, self.callback() if self.callback else self.value
+
+
+class Histogram(Metric):
+    """Exposes a LatencyHistogram; observe on the histogram itself to keep the hot path a plain bisect."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, histogram: Optional[LatencyHistogram] = None, **labels: str):
+        super().__init__(name, help_text, **labels)
+        self.histogram = histogram if histogram is not None else LatencyHistogram()
+
+    def observe(self, value: float):
+        self.histogram.observe(value)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.histogram.buckets, self.histogram.counts):
+            cumulative += count
+            yield "_bucket", {"le": f"{bound:g}"}, cumulative
+        yield "_bucket", {"le": "+Inf"}, self.histogram.count
+        yield "_sum", {}, self.histogram.sum
+        yield "_count", {}, self.histogram.count
+
+
+REGISTRY: List[Metric] = []
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    # Samples of one metric name have to be contiguous, whatever order the label sets were registered in
+    families: Dict[str, List[Metric]] = {}
+    for metric in REGISTRY:
+        families.setdefault(metric.name, []).append(metric)
+
+    lines = []
+    for name, metrics in families.items():
+        lines.append(f"# HELP {name} {metrics[0].help}")
+        lines.append(f"# TYPE {name} {metrics[0].kind}")
+        for metric in metrics:
+            for suffix, extra_labels, value in metric.samples():
+                labels = {**metric.labels, **extra_labels}
+                label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
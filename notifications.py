@@ -0,0 +1,101 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import timedelta
+from typing import Awaitable, Callable, Deque, Optional
+from telegram.error import RetryAfter
+from log import log_event
+
+logger = logging.getLogger("muppet.notifications")
+
+# Notification configuration from environment variables with fallbacks
+# Seconds between digests, Telegram allows about 20 messages per minute in a group
+NOTIFY_INTERVAL = float(os.environ.get("NOTIFY_INTERVAL", "3"))
+# Events kept waiting for the next digest, anything beyond is only counted
+NOTIFY_QUEUE_SIZE = int(os.environ.get("NOTIFY_QUEUE_SIZE", "500"))
+# Events quoted verbatim in one digest, the rest are summarized
+NOTIFY_MAX_LINES = int(os.environ.get("NOTIFY_MAX_LINES", "20"))
+
+# Telegram rejects longer messages
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Attempts per digest when Telegram asks us to slow down
+MAX_SEND_ATTEMPTS = 3
+
+
+class NotificationQueue:
+    """Collects notifications and sends them to Telegram as periodic digests from a background task.
+
+    notify() never waits, so it is safe to call from the websocket handlers. Each digest quotes up to
+    max_lines events and summarizes the rest, together with any events dropped because the queue was full.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[None]], interval: float = NOTIFY_INTERVAL,
+                 maxsize: int = NOTIFY_QUEUE_SIZE, max_lines: int = NOTIFY_MAX_LINES):
+        self.send = send
+        self.interval = interval
+        self.maxsize = maxsize
+        self.max_lines = max_lines
+        self.events: Deque[str] = deque()
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self, message: str):
+        """Queue a notification for the next digest."""
+        if len(self.events) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.events.append(message)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and send whatever is still queued."""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def _digest(self) -> Optional[str]:
+        if not self.events and not self.dropped:
+            return None
+        lines = []
+        while self.events and len(lines) < self.max_lines:
+            lines.append(self.events.popleft())
+        skipped = len(self.events) + self.dropped
+        self.events.clear()
+        self.dropped = 0
+        if skipped:
+            lines.append(f"… and {skipped} more events")
+        return "\n".join(lines)[:TELEGRAM_MESSAGE_LIMIT]
+
+    async def flush(self):
+        """Send the pending events as one digest, backing off when Telegram rate limits us."""
+        text = self._digest()
+        if not text:
+            return
+        for _ in range(MAX_SEND_ATTEMPTS):
+            try:
+                await self.send(text)
+                return
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                log_event(logger, "notification_rate_limited", "Telegram rate limit hit, retrying notification in %s seconds",
+                          delay, level=logging.WARNING, retry_after=delay)
+                await asyncio.sleep(delay)
+        log_event(logger, "notification_dropped", "Giving up on notification after %d attempts", MAX_SEND_ATTEMPTS,
+                  level=logging.WARNING)
@@ -0,0 +1,138 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+import random
+import re
+from typing import Dict, Iterator, List, Optional
+import websockets
+
+
+class ClientRegistry:
+    """Connected clients of one type.
+
+    Members live in a dense list with a position index, so add, remove and membership checks are O(1)
+    and a random subset of k clients is drawn in O(k). Clients are also indexed by host, and the sorted
+    host listing used by /status is cached until membership changes.
+    """
+
+    def __init__(self):
+        self._members: List[websockets.ServerProtocol] = []
+        self._positions: Dict[websockets.ServerProtocol, int] = {}
+        self._host_of: Dict[websockets.ServerProtocol, str] = {}
+        self._by_host: Dict[str, Dict[websockets.ServerProtocol, None]] = {}
+        self._sorted_hosts: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, websocket) -> bool:
+        return websocket in self._positions
+
+    def __iter__(self) -> Iterator[websockets.ServerProtocol]:
+        # Iterate over a snapshot so callers may remove clients while walking the registry
+        return iter(list(self._members))
+
+    def add(self, websocket: websockets.ServerProtocol, host: str) -> bool:
+        """Register a client; returns False if it was already registered."""
+        if websocket in self._positions:
+            return False
+        self._positions[websocket] = len(self._members)
+        self._members.append(websocket)
+        self._host_of[websocket] = host
+        self._by_host.setdefault(host, {})[websocket] = None
+        self._sorted_hosts = None
+        return True
+
+    def remove(self, websocket: websockets.ServerProtocol) -> bool:
+        """Unregister a client; returns False if it was not registered."""
+        position = self._positions.pop(websocket, None)
+        if position is None:
+            return False
+        # Move the last member into the freed slot so the list stays dense
+        last = self._members.pop()
+        if last is not websocket:
+            self._members[position] = last
+            self._positions[last] = position
+
+        host = self._host_of.pop(websocket)
+        host_clients = self._by_host[host]
+        del host_clients[websocket]
+        if not host_clients:
+            del self._by_host[host]
+        self._sorted_hosts = None
+        return True
+
+    def sample(self, k: int) -> List[websockets.ServerProtocol]:
+        """Return k distinct random clients (or all of them if there are fewer)."""
+        members = self._members
+        n = len(members)
+        k = min(k, n)
+        # Partial Fisher-Yates shuffle: the first k slots end up holding the sample
+        for i in range(k):
+            j = random.randrange(i, n)
+            if i != j:
+                members[i], members[j] = members[j], members[i]
+                self._positions[members[i]] = i
+                self._positions[members[j]] = j
+        return members[:k]
+
+    def by_host(self, host: str) -> List[websockets.ServerProtocol]:
+        """Return the clients connected from a host."""
+        return list(self._by_host.get(host, ()))
+
+    def host_count(self, host: str) -> int:
+        return len(self._by_host.get(host, ()))
+
+    def hosts(self) -> List[str]:
+        """Return the host of every client, sorted; hosts with several connections repeat."""
+        if self._sorted_hosts is None:
+            self._sorted_hosts = [
+                host for host in sorted(self._by_host) for _ in range(len(self._by_host[host]))
+            ]
+        return self._sorted_hosts
+
+
+# Group of clients that did not name one at handshake
+DEFAULT_GROUP = "default"
+_GROUP_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def is_valid_group(name: str) -> bool:
+    return bool(_GROUP_NAME.match(name))
+
+
+class ClientGroups:
+    """Registries of the clients of each type per named group, e.g. one group per installation.
+
+    A command for a group samples and fans out over that group's registry only, so its cost follows
+    the group's size rather than the fleet's. Groups exist while they have members.
+    """
+
+    def __init__(self):
+        self._groups: Dict[str, Dict[str, ClientRegistry]] = {}
+
+    def __contains__(self, group: str) -> bool:
+        return group in self._groups
+
+    def add(self, websocket: websockets.ServerProtocol, client_type: str, host: str, group: str) -> bool:
+        registries = self._groups.setdefault(group, {})
+        return registries.setdefault(client_type, ClientRegistry()).add(websocket, host)
+
+    def remove(self, websocket: websockets.ServerProtocol, client_type: str, group: str) -> bool:
+        registries = self._groups.get(group, {})
+        registry = registries.get(client_type)
+        if registry is None or not registry.remove(websocket):
+            return False
+        if not registry:
+            del registries[client_type]
+            if not registries:
+                del self._groups[group]
+        return True
+
+    def members(self, client_type: str, group: str) -> ClientRegistry:
+        """The group's clients of a type; an empty registry for unknown groups."""
+        return self._groups.get(group, {}).get(client_type) or ClientRegistry()
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Number of clients per group and type."""
+        return {group: {client_type: len(registry) for client_type, registry in registries.items()}
+                for group, registries in self._groups.items()}
@@ -1,18 +1,51 @@
 # pylint: disable=missing-docstring
 # flake8: noqa: E501
 import asyncio
-import random
+import hashlib
+import hmac
+import heapq
+import logging
 import os
-from typing import Dict, List, Optional
+import random
+import secrets
+import signal
+import socket
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
 import websockets
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, ContextTypes
 from aiohttp import web
+from admin import AdminAPI
+from admission import AdmissionControl
+from acks import ACK_TIMEOUT, CommandTracker, TrackedCommand, parse_ack
+from backplane import create_backplane
+from cluster import Cluster, ClusterCommand, local_due_at, merge_hosts
+from fanout import ClientChannel, fan_out
+from heartbeats import HEARTBEAT_TIMEOUT, PLAYING, STATUSES, VLC_DOWN, parse_heartbeat, parse_seeked
+from log import log_event, setup_logging
+from loopwatch import LoopWatchdog
+from metrics import Counter, Gauge, Histogram, render as render_metrics
+from notifications import NotificationQueue
+from registry import DEFAULT_GROUP, ClientGroups, ClientRegistry, is_valid_group
+import timecodes
+
+logger = logging.getLogger("muppet.server")
 
 # Get configuration from environment variables with fallbacks
 AUTH_TOKEN = os.environ.get("AUTH_TOKEN", "secret_token_123")
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN", "YOUR_TELEGRAM_BOT_TOKEN")
 CALLBACKS_ENABLED = os.environ.get("CALLBACKS_ENABLED", "false").lower() == "true"
+# Bot API endpoint, the token is appended; point it at a fake Bot API to test locally
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# Public HTTPS URL Telegram posts updates to, routed to WEBHOOK_PATH on HTTP_PORT; empty to poll for updates
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# Telegram sends it with every update; defaults to one derived from the bot token, the same on every replica
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(f"muppet-webhook:{TELEGRAM_TOKEN}".encode()).hexdigest()
 
 # Authorized chat ID (messages from other chats will be ignored)
 AUTHORIZED_CHAT_ID_STR = os.environ.get("AUTHORIZED_CHAT_ID", "")
@@ -27,79 +60,282 @@ except ValueError:
 # Default to all interfaces in container
 HOST = os.environ.get("HOST", "0.0.0.0")
 PORT = int(os.environ.get("PORT", "8765"))
+# Port of the HTTP server (health checks, metrics, admin API, webhook); give every replica on a host its own
+HTTP_PORT = int(os.environ.get("HTTP_PORT", "8080"))
+
+# Where replicas meet: empty for a single replica, tcp://host:port for a backplane hub
+BACKPLANE_URL = os.environ.get("BACKPLANE_URL", "")
+
+# Seconds between dispatching a seek and the moment seekers run it, must cover fan-out and clock sync error
+SEEK_LEAD_TIME = float(os.environ.get("SEEK_LEAD_TIME", "0.5"))
+
+# Seconds a client has to send its auth message after connecting
+HANDSHAKE_TIMEOUT = float(os.environ.get("HANDSHAKE_TIMEOUT", "10"))
+
+# Seconds a disconnected client can resume its session and get the latest command it missed
+RESUME_WINDOW = float(os.environ.get("RESUME_WINDOW", "60"))
+# Recent commands kept per client type for replay to resuming clients
+REPLAY_BUFFER_SIZE = int(os.environ.get("REPLAY_BUFFER_SIZE", "16"))
+
+# Seconds over which a draining server spreads the reconnects of its clients
+DRAIN_WINDOW = float(os.environ.get("DRAIN_WINDOW", "10"))
+# Seconds a client may stay past its reconnect slot before a draining server disconnects it
+DRAIN_GRACE = float(os.environ.get("DRAIN_GRACE", "5"))
+# Seconds a client has to answer our close frame before the connection is dropped
+CLOSE_TIMEOUT = float(os.environ.get("CLOSE_TIMEOUT", "10"))
+# Seconds the last notification digest may take to send on shutdown
+SHUTDOWN_FLUSH_TIMEOUT = float(os.environ.get("SHUTDOWN_FLUSH_TIMEOUT", "5"))
+# Bind with SO_REUSEPORT, so a new server process on the same host can listen while the old one drains
+REUSE_PORT = os.environ.get("REUSE_PORT", "true").lower() == "true" and hasattr(socket, "SO_REUSEPORT")
 
 # Client types
 CLIENT_TYPE_SEEKER = "seeker"
 CLIENT_TYPE_SWITCHER = "switcher"
 
 # Organized clients by type
-clients: Dict[str, List[websockets.ServerProtocol]] = {
-    CLIENT_TYPE_SEEKER: [],
-    CLIENT_TYPE_SWITCHER: []
+clients: Dict[str, ClientRegistry] = {
+    CLIENT_TYPE_SEEKER: ClientRegistry(),
+    CLIENT_TYPE_SWITCHER: ClientRegistry()
 }
 
+# The same clients per named group, so commands for one installation only touch its members
+groups = ClientGroups()
+
 # Additional client information
 client_info: Dict[websockets.ServerProtocol, dict] = {}
 
+# Broadcast commands waiting for confirmations, with latency histograms
+commands = CommandTracker()
 
-async def broadcast_to_clients_by_type(message: str, client_type: str):
-    """Broadcast message to all clients of a specific type."""
-    if not clients[client_type]:
-        print(f"No clients of type {client_type} connected")
-        return
+# Bounds concurrent handshakes so a reconnect storm after a restart is absorbed at a steady pace
+admission = AdmissionControl()
 
-    disconnected = set()
-    for client in clients[client_type]:
-        try:
-            await client.send(message)
-        except websockets.exceptions.ConnectionClosed:
-            disconnected.add(client)
+# Set once the server drains its clients for a restart
+draining = False
 
-    # Clean up any disconnected clients
+# Measures event loop lag, logs what blocks the loop and profiles it on demand
+watchdog = LoopWatchdog()
+
+# Recently published commands per client type, with the wall clock time they were seen
+recent_commands: Dict[str, Deque[dict]] = {
+    client_type: deque(maxlen=REPLAY_BUFFER_SIZE) for client_type in clients
+}
+
+# Metrics exposed on /metrics, per client type where it applies
+connected_clients_gauge = {
+    client_type: Gauge("muppet_connected_clients", "Currently connected clients",
+                       callback=members.__len__, type=client_type)
+    for client_type, members in clients.items()
+}
+connections_counter = {
+    client_type: Counter("muppet_connections_total", "Accepted client connections", type=client_type)
+    for client_type in clients
+}
+disconnections_counter = {
+    client_type: Counter("muppet_disconnections_total", "Client disconnections", type=client_type)
+    for client_type in clients
+}
+messages_counter = {
+    client_type: Counter("muppet_messages_received_total", "Messages received from clients", type=client_type)
+    for client_type in clients
+}
+broadcasts_counter = {
+    client_type: Counter("muppet_broadcasts_total", "Broadcasts sent", type=client_type)
+    for client_type in clients
+}
+broadcast_duration_histogram = {
+    client_type: Histogram("muppet_broadcast_duration_seconds", "Time to fan a broadcast out to its recipients", type=client_type)
+    for client_type in clients
+}
+send_failures_counter = {
+    client_type: Counter("muppet_send_failures_total", "Broadcast deliveries that were not confirmed in time", type=client_type)
+    for client_type in clients
+}
+evictions_counter = {
+    client_type: Counter("muppet_evicted_clients_total", "Clients dropped during a broadcast", type=client_type)
+    for client_type in clients
+}
+superseded_counter = {
+    client_type: Counter("muppet_superseded_commands_total", "Commands dropped for a newer one before they ran", type=client_type)
+    for client_type in clients
+}
+seekers_gauge = {
+    status: Gauge("muppet_seekers", "Seekers by the playback status of their last heartbeat",
+                  callback=lambda status=status: playback_counts().get(status, 0), status=status)
+    for status in STATUSES
+}
+heartbeat_timeouts_counter = {
+    client_type: Counter("muppet_heartbeat_timeouts_total", "Clients dropped after their heartbeats stopped", type=client_type)
+    for client_type in clients
+}
+replays_counter = {
+    client_type: Counter("muppet_replayed_commands_total", "Missed commands replayed to resuming clients", type=client_type)
+    for client_type in clients
+}
+Gauge("muppet_handshakes_in_progress", "Handshakes holding an admission slot", callback=lambda: admission.active)
+Gauge("muppet_handshakes_queued", "Handshakes waiting for an admission slot", callback=lambda: admission.queued)
+handshake_rejections_counter = Counter("muppet_handshake_rejections_total", "Handshakes turned away with a retry-after hint")
+Gauge("muppet_draining", "1 while the server hands its clients over for a restart", callback=lambda: int(draining))
+auth_failures_counter = Counter("muppet_auth_failures_total", "Rejected handshakes")
+Histogram("muppet_command_ack_latency_seconds", "Time from a command being due to its confirmation", commands.latency)
+
+
+def playback_counts() -> Dict[str, int]:
+    """Number of seekers per reported playback status, from the state table in client_info."""
+    counts: Dict[str, int] = {}
+    for client in clients[CLIENT_TYPE_SEEKER]:
+        playback = client_info[client]['playback'] if client in client_info else None
+        if playback is not None:
+            counts[playback.status] = counts.get(playback.status, 0) + 1
+    return counts
+
+
+def register_client(websocket: websockets.ServerProtocol, client_type: str, host: str, group: str):
+    clients[client_type].add(websocket, host)
+    groups.add(websocket, client_type, host, group)
+
+
+def unregister_client(websocket: websockets.ServerProtocol, client_type: str, group: str) -> bool:
+    """Remove a client from the registries; returns False if it was not registered."""
+    groups.remove(websocket, client_type, group)
+    return clients[client_type].remove(websocket)
+
+
+def members_of(client_type: str, group: Optional[str] = None) -> ClientRegistry:
+    """Clients of a type in one group, or in all groups without one."""
+    return clients[client_type] if group is None else groups.members(client_type, group)
+
+
+async def reap_silent_clients():
+    """Drop clients whose heartbeats stopped, long before TCP would notice a dead peer."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_TIMEOUT / 3)
+        now = time.monotonic()
+        for info in list(client_info.values()):
+            # Clients from before heartbeats existed never send any, only judge those that do
+            if info['heartbeats'] and now - info['last_seen'] > HEARTBEAT_TIMEOUT and not info['channel'].closed:
+                heartbeat_timeouts_counter[info['type']].inc()
+                log_event(logger, "heartbeat_timeout", "No heartbeat from %s client %s for %.0f seconds",
+                          info['type'], info['host'], now - info['last_seen'], level=logging.WARNING,
+                          client_type=info['type'], host=info['host'])
+                info['channel'].evict("heartbeat timeout")
+
+
+async def deliver(recipients: List[websockets.ServerProtocol], message: str, client_type: str,
+                  command: Optional[TrackedCommand] = None, latest_wins: bool = False,
+                  per_client: Optional[Callable[[websockets.ServerProtocol], str]] = None):
+    """Fan a message out to the given clients concurrently and drop the ones that went away.
+
+    With latest_wins, a newer message of the same command replaces this one for clients that have
+    not been sent it yet. per_client builds a client's own variant of the message; clients that get
+    the same text still share one encoded frame.
+    """
+    channels = [client_info[client]['channel'] for client in recipients if client in client_info]
+    by_text: Dict[str, List[ClientChannel]] = {}
+    for channel in channels:
+        by_text.setdefault(message if per_client is None else per_client(channel.websocket), []).append(channel)
+    key = message.split()[0] if latest_wins else None
+    started = time.monotonic()
+    results = await asyncio.gather(*(fan_out(same_text, text, key=key) for text, same_text in by_text.items()))
+    delivered = sum(result[0] for result in results)
+    failed = [channel for result in results for channel in result[1]]
+    superseded = [channel for result in results for channel in result[2]]
+    broadcasts_counter[client_type].inc()
+    broadcast_duration_histogram[client_type].observe(time.monotonic() - started)
+    if failed:
+        send_failures_counter[client_type].inc(len(failed))
+    if superseded:
+        superseded_counter[client_type].inc(len(superseded))
+        if command:
+            for channel in superseded:
+                command.supersede(channel.websocket)
+
+    # Clean up any disconnected clients, slow but still open ones are only reported
+    disconnected = []
+    for channel in failed:
+        if command:
+            command.discard(channel.websocket)
+        if channel.closed:
+            channel.close()
+            disconnected.append(channel.websocket)
     for client in disconnected:
-        if client in clients[client_type]:
-            clients[client_type].remove(client)
-        client_info.pop(client, None)
+        info = client_info.pop(client, None)
+        if info is not None:
+            unregister_client(client, client_type, info['group'])
+
+    slow = len(failed) - len(disconnected)
+    if slow:
+        log_event(logger, "slow_clients", "%d slow %s clients did not confirm delivery in time", slow, client_type,
+                  level=logging.WARNING, client_type=client_type, count=slow)
 
     if disconnected:
+        evictions_counter[client_type].inc(len(disconnected))
         msg = f"Removed {len(disconnected)} disconnected {client_type} clients. " \
             f"Total {client_type} clients: {len(clients[client_type])}"
-        await send_notification(f"⚠️ {msg}")
-        print(msg)
-
-
-async def broadcast_to_random_seekers(message: str):
-    """Broadcast message to a random subset of seeker clients (n/2+1)."""
-    seekers = clients[CLIENT_TYPE_SEEKER]
+        log_event(logger, "clients_removed", msg, level=logging.WARNING, client_type=client_type,
+                  count=len(disconnected), total=len(clients[client_type]))
+        notifications.notify(f"⚠️ {msg}")
+
+    return delivered
+
+
+async def broadcast_to_clients_by_type(message: str, client_type: str, command_id: Optional[int] = None,
+                                       group: Optional[str] = None) -> Optional[TrackedCommand]:
+    """Broadcast message to all clients of a specific type, in one group or in all of them."""
+    members = members_of(client_type, group)
+    if not members:
+        log_event(logger, "no_recipients", "No clients of type %s connected", client_type, client_type=client_type, group=group)
+        return None
+
+    recipients = list(members)
+    command = commands.start(message.split()[0], recipients, command_id=command_id)
+    log_event(logger, "command_dispatched", "Broadcasting %s to %d %s clients", message, len(recipients), client_type,
+              command=message, command_id=command.id, client_type=client_type, recipients=len(recipients), group=group)
+    await deliver(recipients, command.tag(message), client_type, command)
+    return command
+
+
+def seek_message(client: websockets.ServerProtocol, timecode: str, due_at: Optional[float], command_id: int) -> str:
+    """Build one seeker's /seek message, with the timecode resolved to absolute seconds when we can.
+
+    Seekers whose duration or position we do not know yet get the timecode as is and resolve it themselves.
+    """
+    info = client_info.get(client, {})
+    playback = info.get('playback')
+    position = playback.current_position(due_at) if playback else None
+    seconds = timecodes.resolve(timecode, info.get('duration'), position)
+    text = f"/seek {timecode if seconds is None else seconds}"
+    if due_at is not None:
+        text = f"{text} @{due_at:.3f}"
+    return f"{text} #{command_id}"
+
+
+async def broadcast_to_random_seekers(message: str, due_at: Optional[float] = None, count: Optional[int] = None,
+                                      command_id: Optional[int] = None, group: Optional[str] = None) -> Optional[TrackedCommand]:
+    """Broadcast a "/seek <timecode>" message to a random subset of seeker clients (n/2+1, or count when the leader chose it),
+    in one group or in all of them.
+
+    Each seeker gets the timecode resolved against its own video, and the due time if there is one.
+    """
+    seekers = members_of(CLIENT_TYPE_SEEKER, group)
     if not seekers:
-        print("No seeker clients connected")
-        return
+        log_event(logger, "no_recipients", "No seeker clients connected", client_type=CLIENT_TYPE_SEEKER, group=group)
+        return None
 
     # Calculate number of seekers to send to (n/2+1)
-    num_recipients = max(1, (len(seekers) // 2) + 1)
+    num_recipients = max(1, (len(seekers) // 2) + 1) if count is None else count
     # Select random subset of seekers
-    recipients = random.sample(seekers, min(num_recipients, len(seekers)))
+    recipients = seekers.sample(num_recipients)
 
-    print(f"Broadcasting to {len(recipients)} of {len(seekers)} seekers")
-
-    disconnected = set()
-    for client in recipients:
-        try:
-            await client.send(message)
-        except websockets.exceptions.ConnectionClosed:
-            disconnected.add(client)
-
-    # Clean up any disconnected clients
-    for client in disconnected:
-        if client in clients[CLIENT_TYPE_SEEKER]:
-            clients[CLIENT_TYPE_SEEKER].remove(client)
-        client_info.pop(client, None)
-
-    if disconnected:
-        msg = f"Removed {len(disconnected)} disconnected seeker clients. " \
-            f"Total seeker clients: {len(clients[CLIENT_TYPE_SEEKER])}"
-        print(msg)
-        await send_notification(f"⚠️ {msg}")
+    command = commands.start(message.split()[0], recipients, due_at, command_id)
+    log_event(logger, "command_dispatched", "Broadcasting %s to %d of %d seekers", message, len(recipients), len(seekers),
+              command=message, command_id=command.id, client_type=CLIENT_TYPE_SEEKER,
+              recipients=len(recipients), total=len(seekers), group=group)
+    timecode = message.split()[1]
+    # Only the newest seek matters, so a client that has not been sent an earlier one yet skips it
+    await deliver(recipients, message, CLIENT_TYPE_SEEKER, command, latest_wins=True,
+                  per_client=lambda client: seek_message(client, timecode, due_at, command.id))
+    return command
 
 
 async def send_notification(message):
@@ -108,80 +344,356 @@ async def send_notification(message):
     if AUTHORIZED_CHAT_ID and application:
         try:
             await application.bot.send_message(chat_id=AUTHORIZED_CHAT_ID, text=message)
+        except RetryAfter:
+            # Let the notification queue back off and retry
+            raise
         except Exception as e:
-            print(f"Failed to send notification: {e}")
+            log_event(logger, "notification_failed", "Failed to send notification: %s", e, level=logging.WARNING)
+
+
+# Connection events are batched into digests instead of being sent from the websocket handlers
+notifications = NotificationQueue(send_notification)
+
+
+def roster() -> dict:
+    """This replica's connections, as published to the other replicas."""
+    return {
+        "counts": {client_type: len(members) for client_type, members in clients.items()},
+        "hosts": {client_type: members.hosts() for client_type, members in clients.items()},
+        "playback": playback_counts(),
+        "groups": groups.counts(),
+    }
+
+
+def snapshot_order(client: dict):
+    return client["group"], client["type"], client["host"], -client["connected_for"]
+
+
+def client_snapshot() -> List[dict]:
+    """This replica's clients for the admin API, sorted by group, type, host and connection time."""
+    now = time.monotonic()
+    loop_now = asyncio.get_running_loop().time()
+    snapshot = []
+    for websocket, info in client_info.items():
+        playback = info['playback']
+        snapshot.append({
+            "id": str(websocket.id),
+            "type": info['type'],
+            "host": info['host'],
+            "group": info['group'],
+            "replica": cluster.replica_id,
+            "connected_for": loop_now - info['connected_at'],
+            "idle": now - info['last_seen'],
+            "messages_received": info['messages_received'],
+            "playback": playback.as_dict() if playback else None,
+            "ack_latency": commands.host_summary(info['host']),
+        })
+    snapshot.sort(key=snapshot_order)
+    return snapshot
+
+
+async def cluster_clients() -> List[dict]:
+    """The clients of every replica for the admin API, in client_snapshot() order."""
+    listings = await cluster.list_clients()
+    return list(heapq.merge(*listings.values(), key=snapshot_order))
+
+
+def merge_group_counts(members: Dict[str, dict]) -> Dict[str, Dict[str, int]]:
+    """Clients per group and type across the given rosters."""
+    merged: Dict[str, Dict[str, int]] = {}
+    for roster in members.values():
+        for group, counts in roster.get("groups", {}).items():
+            for client_type, count in counts.items():
+                merged.setdefault(group, {})[client_type] = merged.get(group, {}).get(client_type, 0) + count
+    return merged
+
+
+async def cluster_status() -> dict:
+    """Client counts and playback states across the cluster, for the admin API."""
+    members = await cluster.members()
+    return {
+        "replica": cluster.replica_id,
+        "leader": cluster.leader,
+        "counts": {client_type: sum(roster["counts"].get(client_type, 0) for roster in members.values())
+                   for client_type in clients},
+        "playback": {status: sum(roster.get("playback", {}).get(status, 0) for roster in members.values())
+                     for status in STATUSES},
+        "groups": merge_group_counts(members),
+        "replicas": {replica: roster["counts"] for replica, roster in members.items()},
+        "ack_latency": commands.latency.summary(),
+    }
+
+
+async def dispatch_command(name: str, timecode: Optional[str] = None, group: Optional[str] = None) -> ClusterCommand:
+    """Publish a seek (to a random n/2+1 of the seekers) or a switch (to every switcher) across the cluster,
+    for one group or, without group, for all of them. Raises ConnectionError if the backplane is unreachable."""
+    if name == "seek":
+        # Schedule the seek slightly ahead so every selected seeker can run it at the same instant.
+        # Replicas do not share a monotonic clock, so the deadline travels as wall clock time.
+        due_at = time.time() + SEEK_LEAD_TIME
+        return await cluster.dispatch(f"/seek {timecode}", CLIENT_TYPE_SEEKER, sample=True, due_at=due_at, group=group)
+    return await cluster.dispatch("/switch", CLIENT_TYPE_SWITCHER, group=group)
+
+
+async def run_cluster_command(message: dict) -> dict:
+    """Run a command published by the leader on our own clients and report the confirmations."""
+    client_type = message["client_type"]
+    text = message["message"]
+    group = message.get("group")
+    if client_type == CLIENT_TYPE_SEEKER:
+        command = await broadcast_to_random_seekers(text, local_due_at(message["due_at"]), message["quota"][cluster.replica_id],
+                                                    message["id"], group)
+    else:
+        command = await broadcast_to_clients_by_type(text, client_type, message["id"], group)
+    if command is None:
+        return {"expected": 0, "confirmed": 0, "superseded": 0, "failed": 0, "slowest": None}
+    await commands.wait(command)
+    return {
+        "expected": len(command.expected),
+        "confirmed": len(command.latencies),
+        "superseded": command.superseded,
+        "failed": command.failed,
+        "slowest": max(command.latencies.values(), default=None),
+    }
+
+
+def record_command(message: dict):
+    """Keep every published command, also those for other replicas, for clients that resume here."""
+    if message["client_type"] in recent_commands:
+        recent_commands[message["client_type"]].append({**message, "seen_at": time.time()})
+
+
+async def resume_session(websocket: websockets.ServerProtocol, token: str, client_type: str, host: str, group: str):
+    """Replay the latest command for its group a reconnecting client missed while it was away."""
+    parked = await cluster.claim_session(token)
+    if parked is None or parked["type"] != client_type:
+        return
+    missed = [command for command in recent_commands[client_type]
+              if command["seen_at"] > parked["left_at"] and command.get("group") in (None, group)]
+    log_event(logger, "session_resumed", "%s client %s resumed after %.1f seconds, missed %d commands",
+              client_type.capitalize(), host, time.time() - parked["left_at"], len(missed),
+              client_type=client_type, host=host, missed=len(missed))
+    if not missed:
+        return
+
+    # Only the latest command matters: the newest seek position, or the last switch
+    command = missed[-1]
+    if client_type == CLIENT_TYPE_SEEKER:
+        # Due in the past, the seeker makes up for the delay itself
+        text = seek_message(websocket, command["message"].split()[1], local_due_at(command["due_at"]), command["id"])
+    else:
+        text = f"{command['message']} #{command['id']}"
+    replays_counter[client_type].inc()
+    log_event(logger, "command_replayed", "Replaying %s to %s", text, host, command=text, client_type=client_type, host=host)
+    client_info[websocket]['channel'].offer(text.encode("utf-8"), key=text.split()[0])
+
+
+async def register_webhook() -> bool:
+    """Point Telegram at our webhook; returns False if it refused, e.g. because WEBHOOK_URL is not HTTPS."""
+    try:
+        await application.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    except TelegramError as e:
+        log_event(logger, "webhook_failed", "Could not set the Telegram webhook, polling instead: %s", e,
+                  level=logging.WARNING, url=WEBHOOK_URL)
+        return False
+    log_event(logger, "webhook_registered", "Telegram webhook set to %s by replica %s", WEBHOOK_URL, cluster.replica_id,
+              url=WEBHOOK_URL)
+    return True
+
+
+async def on_leadership(leader: bool):
+    """Only the leader talks to Telegram about updates, two pollers on one bot token would conflict.
+
+    In webhook mode the leader registers the webhook and every replica handles the updates routed to
+    it; the leader falls back to polling if Telegram refuses the webhook. Every replica keeps sending
+    its own notifications, which does not need either.
+    """
+    if application is None or application.updater is None:
+        return
+    if leader and WEBHOOK_URL and await register_webhook():
+        return
+    if leader and not application.updater.running:
+        await application.updater.start_polling()
+        log_event(logger, "telegram_polling", "Telegram bot started on replica %s", cluster.replica_id)
+    elif not leader and application.updater.running:
+        await application.updater.stop()
+        log_event(logger, "telegram_polling_stopped", "Telegram bot stopped on replica %s", cluster.replica_id)
+
+
+cluster = Cluster(create_backplane(BACKPLANE_URL), roster, run_cluster_command, on_leadership,
+                  ack_timeout=ACK_TIMEOUT, on_command=record_command, snapshot=client_snapshot)
 
 
 async def handle_connection(websocket: websockets.ServerProtocol):
     """Handle a new client connection."""
     global CALLBACKS_ENABLED
+    session: Optional[dict] = None
+    admitted_at: Optional[float] = None
     try:
-        # Wait for the first message which should be the auth token and client type
-        auth_message = await websocket.recv()
+        # Wait for the first message which should be the auth token and client type. Only then take a
+        # handshake slot, so connections that stay silent or half-open cannot crowd out healthy clients
+        auth_message = await asyncio.wait_for(websocket.recv(), HANDSHAKE_TIMEOUT)
+
+        if not await admission.acquire():
+            # Tell the client when the backlog should have cleared instead of letting it hammer us
+            retry_after = admission.retry_after()
+            handshake_rejections_counter.inc()
+            log_event(logger, "handshake_rejected", "Server busy, asking client to retry in %.1f seconds", retry_after,
+                      level=logging.WARNING, sampled=True, retry_after=retry_after, queued=admission.queued)
+            await websocket.send(f"/retry {retry_after:.1f}")
+            await websocket.close(1013, "Server busy")
+            return
+        admitted_at = time.monotonic()
 
-        # Parse auth message (format: "AUTH_TOKEN:CLIENT_TYPE:HOST")
-        parts = auth_message.split(":", 2)
-        if len(parts) != 3 or parts[0] != AUTH_TOKEN:
+        # Parse auth message (format: "AUTH_TOKEN:CLIENT_TYPE:HOST", optionally followed by ":SESSION" when
+        # reconnecting, ":DURATION" once a seeker knows its video's length and ":GROUP" to join a group,
+        # each may be empty)
+        parts = auth_message.split(":", 5)
+        if len(parts) < 3 or parts[0] != AUTH_TOKEN:
             # Send error message and close the connection
+            auth_failures_counter.inc()
             await websocket.send("Authentication failed: Invalid token or format")
             await websocket.close(1008, "Unauthorized")
             return
 
         client_type = parts[1].lower()
         if client_type not in [CLIENT_TYPE_SEEKER, CLIENT_TYPE_SWITCHER]:
+            auth_failures_counter.inc()
             await websocket.send(f"Invalid client type: {client_type}. Must be '{CLIENT_TYPE_SEEKER}' or '{CLIENT_TYPE_SWITCHER}'")
             await websocket.close(1008, "Invalid client type")
             return
 
         host = parts[2]
+        resume_token = parts[3] if len(parts) > 3 and parts[3] else None
+        try:
+            duration = float(parts[4]) if len(parts) > 4 and parts[4] else None
+        except ValueError:
+            duration = None
+        group = parts[5] if len(parts) > 5 and parts[5] else DEFAULT_GROUP
+        if not is_valid_group(group):
+            auth_failures_counter.inc()
+            await websocket.send(f"Invalid group: {group}. Use up to 64 letters, digits, '.', '_' or '-'")
+            await websocket.close(1008, "Invalid group")
+            return
         # Add client to appropriate list
-        clients[client_type].append(websocket)
+        register_client(websocket, client_type, host, group)
+        connections_counter[client_type].inc()
         client_info[websocket] = {
             'type': client_type,
             'host': host,
+            'group': group,
             'connected_at': asyncio.get_event_loop().time(),
-            'messages_received': 0
+            'messages_received': 0,
+            'channel': ClientChannel(websocket),
+            # Liveness and, for seekers, the last reported playback state (a PlaybackState)
+            'last_seen': time.monotonic(),
+            'heartbeats': False,
+            'playback': None,
+            # Video length in seconds, from the handshake and later from heartbeats, to resolve timecodes
+            'duration': duration,
         }
+        session = {"token": resume_token or secrets.token_hex(8), "type": client_type, "host": host}
 
         connection_msg = f"{client_type.capitalize()} client connected from {host}. " \
             f"Total {client_type} clients: {len(clients[client_type])}"
-        print(connection_msg)
+        log_event(logger, "client_connected", connection_msg, client_type=client_type, host=host,
+                  total=len(clients[client_type]), group=group)
 
         # Send notification to the authorized chat
-        await send_notification(f"🟢 {connection_msg}")
+        notifications.notify(f"🟢 {connection_msg}")
 
         # Send welcome message
         await websocket.send(
             f"Authentication successful! Welcome to the WebSocket server as {client_type}."
         )
+        # The client presents this token when it reconnects, to get the commands it missed
+        await websocket.send(f"/session {session['token']}")
+        if resume_token:
+            await resume_session(websocket, resume_token, client_type, host, group)
+        admission.release(admitted_at)
+        admitted_at = None
 
         # Handle incoming messages
+        info = client_info[websocket]
         async for message in websocket:
+            info['last_seen'] = time.monotonic()
+
+            # Clock sync probe from a seeker, answer right away with our clock
+            if message.startswith("/time "):
+                await websocket.send(f"{message} {time.monotonic():.6f}")
+                continue
+
+            # Periodic heartbeat, from seekers with their playback state (format: /heartbeat <position> <duration> <status>)
+            if message.startswith("/heartbeat"):
+                info['heartbeats'] = True
+                playback = parse_heartbeat(message)
+                if playback is not None:
+                    info['playback'] = playback
+                    info['duration'] = playback.duration or info['duration']
+                continue
+
             if CALLBACKS_ENABLED:
-                await send_notification(f"Message received from {client_type} ({host}): {message}")
-            print(f"Received message from {client_type} ({host}): {message}")
-            client_info[websocket]['messages_received'] += 1
+                notifications.notify(f"Message received from {client_type} ({host}): {message}")
+            log_event(logger, "message_received", "Received message from %s (%s): %s", client_type, host, message,
+                      sampled=True, client_type=client_type, host=host)
+            info['messages_received'] += 1
+            messages_counter[client_type].inc()
+
+            # Confirmation of a broadcast command (format: "<reply> #<command id>"), news that the
+            # client dropped it for a newer one (format: "superseded #<command id>"), or that it could
+            # not carry it out (format: "seek_failed #<command id>")
+            command_id = parse_ack(message)
+            if command_id is not None:
+                if message.startswith("superseded "):
+                    superseded_counter[client_type].inc()
+                    commands.supersede(command_id, websocket)
+                elif message.startswith("seek_failed "):
+                    commands.fail(command_id, websocket)
+                else:
+                    commands.ack(command_id, websocket, host)
+                    # A seek confirmation also tells us the seeker's new position
+                    previous = info['playback']
+                    playback = parse_seeked(message, previous.status if previous and previous.status != VLC_DOWN else PLAYING)
+                    if playback is not None:
+                        info['playback'] = playback
+                        info['duration'] = playback.duration or info['duration']
             # Echo the message back
             # await websocket.send(f"Server received: {message}")
 
     except websockets.exceptions.ConnectionClosed:
-        print("Client disconnected")
+        log_event(logger, "connection_closed", "Client disconnected", level=logging.DEBUG)
+    except asyncio.TimeoutError:
+        log_event(logger, "handshake_timeout", "Client did not authenticate within %s seconds", HANDSHAKE_TIMEOUT,
+                  level=logging.WARNING, sampled=True)
     except Exception as e:
-        print(f"Error: {e}")
+        log_event(logger, "connection_error", "Error: %s", e, level=logging.ERROR)
     finally:
+        if admitted_at is not None:
+            admission.release(admitted_at)
         # Clean up when client disconnects
-        client_type = client_info.get(websocket, {}).get('type')
+        info = client_info.get(websocket, {})
+        client_type = info.get('type')
+        if 'channel' in info:
+            info['channel'].close()
 
-        if client_type and websocket in clients[client_type]:
-            clients[client_type].remove(websocket)
+        if client_type and unregister_client(websocket, client_type, info['group']):
             disconnect_msg = f"{client_type.capitalize()} client from {host} disconnected. " \
                 f"Total {client_type} clients: {len(clients[client_type])}"
-            print(disconnect_msg)
+            log_event(logger, "client_disconnected", disconnect_msg, client_type=client_type, host=host,
+                      total=len(clients[client_type]), group=info['group'])
 
             # Send notification to the authorized chat
-            await send_notification(f"🔴 {disconnect_msg}")
+            notifications.notify(f"🔴 {disconnect_msg}")
+            disconnections_counter[client_type].inc()
 
         client_info.pop(websocket, None)
+        if 'host' in info and not any(registry.by_host(info['host']) for registry in clients.values()):
+            commands.forget_host(info['host'])
+
+        if session is not None:
+            # Let the client pick up where it left off if it comes back soon, on any replica
+            await cluster.park_session(session["token"], {"type": session["type"], "host": session["host"],
+                                                          "left_at": time.time()}, RESUME_WINDOW)
 
 
 # Telegram command handlers
@@ -194,45 +706,78 @@ async def check_authorized(update: Update) -> bool:
     chat_id = update.effective_chat.id
     if chat_id != AUTHORIZED_CHAT_ID:
         await update.message.reply_text("Unauthorized: This bot only responds to messages from the authorized chat.")
-        print(f"Rejected command from unauthorized chat ID: {chat_id}")
+        log_event(logger, "unauthorized_chat", "Rejected command from unauthorized chat ID: %s", chat_id,
+                  level=logging.WARNING, chat_id=chat_id)
         return False
     return True
 
 
+async def report_confirmations(update: Update, command: ClusterCommand) -> None:
+    """Reply with how many clients confirmed a command once all replicas reported or the timeout passed."""
+    await cluster.wait(command)
+    await update.message.reply_text(command.summary())
+
+
+def in_group(group: Optional[str]) -> str:
+    return f" in group {group}" if group else ""
+
+
 async def seek_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle the /seek command with optional timecode parameter."""
+    """Handle the /seek command with optional timecode and group parameters."""
     if not await check_authorized(update):
         return
 
-    seeker_count = len(clients[CLIENT_TYPE_SEEKER])
-    if seeker_count == 0:
-        await update.message.reply_text("No seeker clients connected.")
-        return
-
     # Extract timecode from command arguments
     timecode = "0"  # Default to beginning of video if no timecode is provided
     if context.args:
         timecode = context.args[0]
+    if not timecodes.is_valid(timecode):
+        await update.message.reply_text(f"Invalid timecode: {timecode}. Use hh:mm:ss, mm:ss, ss, xx%, -1 or +N/-N seconds.")
+        return
+    # Without a group the command goes to all groups
+    group = context.args[1] if context.args and len(context.args) > 1 else None
+    if group is not None and not is_valid_group(group):
+        await update.message.reply_text(f"Invalid group: {group}")
+        return
+
+    seeker_count = await cluster.count(CLIENT_TYPE_SEEKER, group)
+    if seeker_count == 0:
+        await update.message.reply_text(f"No seeker clients connected{in_group(group)}.")
+        return
 
     # Build seek command with timecode
     seek_command = f"/seek {timecode}"
 
-    await update.message.reply_text(f"Sending seek command to {max(1, (seeker_count // 2) + 1)} of {seeker_count} seeker clients: {seek_command}")
-    await broadcast_to_random_seekers(seek_command)
+    await update.message.reply_text(f"Sending seek command to {max(1, (seeker_count // 2) + 1)} of {seeker_count} seeker clients{in_group(group)}: {seek_command}")
+    try:
+        command = await dispatch_command("seek", timecode, group)
+    except ConnectionError as e:
+        await update.message.reply_text(f"Could not send {seek_command}, the backplane is unreachable: {e}")
+        return
+    context.application.create_task(report_confirmations(update, command), update=update)
 
 
 async def switch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle the /switch command."""
+    """Handle the /switch command with an optional group parameter."""
     if not await check_authorized(update):
         return
+    group = context.args[0] if context.args else None
+    if group is not None and not is_valid_group(group):
+        await update.message.reply_text(f"Invalid group: {group}")
+        return
 
-    switcher_count = len(clients[CLIENT_TYPE_SWITCHER])
+    switcher_count = await cluster.count(CLIENT_TYPE_SWITCHER, group)
     if switcher_count == 0:
-        await update.message.reply_text("No switcher clients connected.")
+        await update.message.reply_text(f"No switcher clients connected{in_group(group)}.")
         return
 
-    await update.message.reply_text(f"Sending switch command to {switcher_count} switcher clients...")
-    await broadcast_to_clients_by_type("/switch", CLIENT_TYPE_SWITCHER)
+    await update.message.reply_text(f"Sending switch command to {switcher_count} switcher clients{in_group(group)}...")
+    try:
+        command = await dispatch_command("switch", group=group)
+    except ConnectionError as e:
+        await update.message.reply_text(f"Could not send /switch, the backplane is unreachable: {e}")
+        return
+    context.application.create_task(report_confirmations(update, command), update=update)
 
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -240,18 +785,29 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not await check_authorized(update):
         return
 
-    seeker_count = len(clients[CLIENT_TYPE_SEEKER])
-    seeker_hosts = [client_info[client]['host'] for client in clients[CLIENT_TYPE_SEEKER]]
-    switcher_count = len(clients[CLIENT_TYPE_SWITCHER])
-    switcher_hosts = [client_info[client]['host'] for client in clients[CLIENT_TYPE_SWITCHER]]
+    members = await cluster.members()
+    seeker_hosts = merge_hosts(members, CLIENT_TYPE_SEEKER)
+    seeker_count = len(seeker_hosts)
+    switcher_hosts = merge_hosts(members, CLIENT_TYPE_SWITCHER)
+    switcher_count = len(switcher_hosts)
+    playback = {status: sum(roster.get("playback", {}).get(status, 0) for roster in members.values()) for status in STATUSES}
+    group_counts = merge_group_counts(members)
+    group_summary = ", ".join(
+        f"{group} ({counts.get(CLIENT_TYPE_SEEKER, 0)} seekers, {counts.get(CLIENT_TYPE_SWITCHER, 0)} switchers)"
+        for group, counts in sorted(group_counts.items())
+    )
 
     status_message = (
         f"Connected clients:\n"
         f"- Seekers: {seeker_count}\n"
-        f"  {', '.join(sorted(seeker_hosts))}\n"
+        f"  {', '.join(seeker_hosts)}\n"
         f"- Switchers: {switcher_count}\n"
-        f"  {', '.join(sorted(switcher_hosts))}\n"
-        f"- Total: {seeker_count + switcher_count}"
+        f"  {', '.join(switcher_hosts)}\n"
+        f"- Total: {seeker_count + switcher_count}\n"
+        f"Playback: {playback['playing']} playing, {playback['paused']} paused, {playback['down']} with VLC down\n"
+        f"Groups: {group_summary or 'none'}\n"
+        f"Replicas: {len(members)}\n"
+        f"Command latency on this replica: {commands.latency.summary()}"
     )
 
     await update.message.reply_text(status_message)
@@ -272,8 +828,10 @@ async def start_websocket_server():
         handle_connection,
         HOST,
         PORT,
+        reuse_port=REUSE_PORT,
+        close_timeout=CLOSE_TIMEOUT,
     )
-    print(f"WebSocket server started on ws://{HOST}:{PORT}")
+    logger.info("WebSocket server started on ws://%s:%s", HOST, PORT)
     return server
 
 
@@ -283,29 +841,99 @@ websocket_server: Optional[websockets.ServerProtocol] = None
 
 
 async def health_check(request):
-    """Health check endpoint"""
+    """Health check endpoint, with event loop lag stats"""
     global websocket_server, application
     # check if the websocket and application are running
     if websocket_server and application:
-        return web.Response(text="OK", status=200)
+        return web.json_response({"status": "OK", "loop": watchdog.stats()}, status=200)
     else:
-        return web.Response(text="Not OK", status=500)
+        return web.json_response({"status": "Not OK", "loop": watchdog.stats()}, status=500)
+
+
+async def readiness_check(request):
+    """Readiness endpoint, failing while the server drains so no new clients are routed here"""
+    if draining or not websocket_server:
+        return web.Response(text="Draining" if draining else "Not ready", status=503)
+    return web.Response(text="OK", status=200)
+
+
+async def telegram_webhook(request):
+    """Telegram webhook endpoint, updates are queued for the bot's handlers as they arrive"""
+    if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), WEBHOOK_SECRET.encode()):
+        log_event(logger, "webhook_unauthorized", "Rejected webhook request from %s", request.remote,
+                  level=logging.WARNING, sampled=True, remote=request.remote)
+        return web.Response(status=403)
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except ValueError:
+        return web.Response(status=400)
+    await application.update_queue.put(update)
+    return web.Response(status=200)
+
+
+async def metrics_endpoint(request):
+    """Prometheus metrics endpoint"""
+    return web.Response(text=render_metrics(), content_type="text/plain")
 
 
 async def start_http_server():
     app = web.Application()
     app.router.add_get('/health', health_check)
+    app.router.add_get('/ready', readiness_check)
+    app.router.add_get('/metrics', metrics_endpoint)
+    if WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, telegram_webhook)
+    AdminAPI(cluster_clients, cluster_status, dispatch_command, cluster.wait, watchdog).add_routes(app)
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, HOST, 8080)  # You can choose a different port if needed
+    site = web.TCPSite(runner, HOST, HTTP_PORT, reuse_port=REUSE_PORT)
     await site.start()
-    print(f"HTTP server started on http://{HOST}:8080/health")
+    logger.info("HTTP server started on http://%s:%s/health, /ready, /metrics and /api", HOST, HTTP_PORT)
+
+
+async def drain():
+    """Hand our clients over to the other replicas, or the process replacing us, a few at a time.
+
+    We stop accepting connections and give up the leader lease right away, then give every client its
+    own slot within DRAIN_WINDOW seconds to reconnect at (format: /reconnect <seconds>). Until then it
+    keeps getting commands from us. Clients still here DRAIN_GRACE seconds after their slot, such as
+    ones that do not know the hint, are disconnected then, so they reconnect spread out as well.
+    """
+    global draining
+    draining = True
+    websocket_server.close(close_connections=False)
+    await cluster.step_down()
+
+    recipients = list(client_info)
+    log_event(logger, "draining", "Draining %d clients over %.0f seconds", len(recipients), DRAIN_WINDOW,
+              clients=len(recipients), window=DRAIN_WINDOW)
+    started = time.monotonic()
+    deadlines = []
+    for slot, websocket in enumerate(recipients):
+        delay = (slot + random.random()) * DRAIN_WINDOW / len(recipients)
+        client_info[websocket]['channel'].offer(f"/reconnect {delay:.2f}".encode("utf-8"))
+        deadlines.append((delay + DRAIN_GRACE, websocket))
+
+    closing = []
+    for deadline, websocket in deadlines:
+        if not client_info:
+            break
+        await asyncio.sleep(started + deadline - time.monotonic())
+        if websocket in client_info:
+            # 1012: service restart, clients reconnect right away
+            closing.append(asyncio.create_task(websocket.close(1012, "Server restarting")))
+    await asyncio.gather(*closing, return_exceptions=True)
+    log_event(logger, "drained", "Drained in %.1f seconds, %d clients had to be disconnected",
+              time.monotonic() - started, len(closing), duration=time.monotonic() - started, disconnected=len(closing))
 
 
 async def main():
     global application, websocket_server
+    setup_logging()
+    watchdog.start()
+
     # Set up the Telegram bot
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_TOKEN).base_url(TELEGRAM_API_URL).build()
 
     # Add command handlers
     application.add_handler(CommandHandler("seek", seek_command))
@@ -317,32 +945,47 @@ async def main():
     application.add_handler(CommandHandler(
         "getchatid", lambda u, c: u.message.reply_text(f"Your chat ID: {u.effective_chat.id}")))
 
-    # Start the Telegram bot
+    # Start the Telegram bot, it polls for updates (or registers the webhook) only while this replica holds
+    # the leader lease
     await application.initialize()
     await application.start()
-    await application.updater.start_polling()
-    print("Telegram bot started!")
+    # Start HTTP server for health check first, the webhook has to be served before it is registered
+    await start_http_server()
+    await cluster.start()
+    logger.info("Telegram bot started!")
 
-    # Start WebSocket server
-    websocket_server = await start_websocket_server()
+    # Start sending queued notifications
+    notifications.start()
 
-    # Start HTTP server for health check
-    await start_http_server()
+    # Start WebSocket server and drop clients whose heartbeats stop
+    websocket_server = await start_websocket_server()
+    reaper = asyncio.create_task(reap_silent_clients())
 
     # Print configuration information
-    print(f"WebSocket server started on ws://{HOST}:{PORT}")
+    logger.info("WebSocket server started on ws://%s:%s", HOST, PORT)
     if AUTHORIZED_CHAT_ID:
-        print(f"Authorized Chat ID: {AUTHORIZED_CHAT_ID}")
+        logger.info("Authorized Chat ID: %s", AUTHORIZED_CHAT_ID)
     else:
-        print("No authorized chat ID set, all chats are allowed")
-        print("Use /getchatid command in Telegram to get your chat ID for configuration")
+        logger.info("No authorized chat ID set, all chats are allowed")
+        logger.info("Use /getchatid command in Telegram to get your chat ID for configuration")
 
-    # Keep the application running
+    # Keep the application running until asked to stop, then hand the clients over before shutting down
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
     try:
-        await asyncio.Future()  # Run forever
+        await stopping.wait()
+        await drain()
     finally:
         # Clean shutdown
-        await send_notification("Server shutting down...")
+        notifications.notify("Server shutting down...")
+        reaper.cancel()
+        watchdog.stop()
+        try:
+            await asyncio.wait_for(notifications.stop(), SHUTDOWN_FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            log_event(logger, "notification_dropped", "Dropped the last notification digest on shutdown", level=logging.WARNING)
+        await cluster.stop()
         await application.stop()
         websocket_server.close()
         await websocket_server.wait_closed()
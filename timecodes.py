@@ -0,0 +1,48 @@
+# pylint: disable=missing-docstring
+# flake8: noqa: E501
+"""Timecodes accepted by /seek, resolved on the server so clients only ever get absolute seconds.
+
+- hh:mm:ss, mm:ss or ss: an absolute position
+- xx%: a share of the video's duration
+- -1: a random position, drawn for every seeker on its own
+- +N or -N: N seconds from the seeker's current position
+"""
+import random
+import re
+from typing import Optional
+
+_HMS = re.compile(r"^(?:(?:(\d+):)?(\d+):)?(\d+)$")
+_PERCENT = re.compile(r"^(\d+)%$")
+_RELATIVE = re.compile(r"^([+-])(\d+)$")
+RANDOM = "-1"
+
+
+def is_valid(timecode: str) -> bool:
+    return bool(_HMS.match(timecode) or _PERCENT.match(timecode) or _RELATIVE.match(timecode))
+
+
+def resolve(timecode: str, duration: Optional[float] = None, position: Optional[float] = None) -> Optional[int]:
+    """Return the absolute position in seconds, or None if it depends on a duration or position we do not know."""
+    match = _HMS.match(timecode)
+    if match:
+        hours, minutes, seconds = (int(group or 0) for group in match.groups())
+        return hours * 3600 + minutes * 60 + seconds
+
+    if not duration:
+        # Everything else is relative to the video
+        return None
+
+    match = _PERCENT.match(timecode)
+    if match:
+        return int(int(match.group(1)) * 0.01 * duration)
+
+    # -1 predates relative offsets and keeps meaning random
+    if timecode == RANDOM:
+        return random.randint(0, int(duration))
+
+    match = _RELATIVE.match(timecode)
+    if match and position is not None:
+        offset = int(match.group(2)) if match.group(1) == "+" else -int(match.group(2))
+        # VLC plays the video in a loop, so offsets wrap around
+        return int(position + offset) % int(duration)
+    return None